@@ -0,0 +1,172 @@
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+from datetime import datetime
+from models import ActivityLog
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger("checktick.activity_log")
+
+# "async": events are queued once the request's transaction commits and
+# written in batches by a background task; a crash can lose the last batch.
+# "sync": the same queue and batched writer, but each response waits until
+# its events are written (ActivityLogFlushMiddleware); for tests and debugging.
+ACTIVITY_LOG_MODE = os.getenv("ACTIVITY_LOG_MODE", "async")
+ACTIVITY_LOG_BATCH_SIZE = int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", "200"))
+ACTIVITY_LOG_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", "0.5"))
+ACTIVITY_LOG_QUEUE_SIZE = int(os.getenv("ACTIVITY_LOG_QUEUE_SIZE", "10000"))
+
+_PENDING_KEY = "pending_activity"
+
+
+class ActivityLogWriter:
+    """Bounded queue of ActivityLog rows, written with multi-row INSERTs."""
+
+    def __init__(self, batch_size: int = ACTIVITY_LOG_BATCH_SIZE, interval: float = ACTIVITY_LOG_FLUSH_INTERVAL,
+                 max_queue: int = ACTIVITY_LOG_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        self._writing = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.write_errors = 0
+
+    def enqueue(self, rows):
+        for row in rows:
+            try:
+                self.queue.put_nowait(row)
+                self.enqueued += 1
+            except asyncio.QueueFull:
+                # Never block a request on the audit trail
+                self.dropped += 1
+                logger.warning("Activity log queue full; dropped %s event for %s", row["action"], row["task_id"])
+
+    async def _write(self, session_factory, rows):
+        try:
+            async with session_factory() as db:
+                await db.exec(insert(ActivityLog).values(rows))
+                await db.commit()
+            self.written += len(rows)
+            self.batches += 1
+        except Exception:
+            self.write_errors += 1
+            logger.exception("Failed to write %s activity log rows", len(rows))
+        finally:
+            for _ in rows:
+                self.queue.task_done()
+
+    async def _next_batch(self):
+        # Wait for one event, then gather more until the batch fills or the interval passes
+        rows = [await self.queue.get()]
+        deadline = time.monotonic() + self.interval
+        while len(rows) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                rows.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return rows
+
+    async def _run(self, session_factory):
+        while True:
+            rows = await self._next_batch()
+            # Shielded so stop() cannot abandon rows already taken off the queue
+            self._writing = asyncio.ensure_future(self._write(session_factory, rows))
+            await asyncio.shield(self._writing)
+
+    def start(self, session_factory):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(session_factory))
+
+    async def stop(self, session_factory):
+        """Stop the writer and write whatever is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writing is not None:
+            await self._writing
+        await self.drain(session_factory)
+
+    async def flush(self, session_factory):
+        """Wait until every event queued so far has been written."""
+        if self._task is None:
+            await self.drain(session_factory)
+        else:
+            await self.queue.join()
+
+    async def drain(self, session_factory):
+        while not self.queue.empty():
+            rows = []
+            while len(rows) < self.batch_size and not self.queue.empty():
+                rows.append(self.queue.get_nowait())
+            await self._write(session_factory, rows)
+
+    def stats(self):
+        return {
+            "mode": ACTIVITY_LOG_MODE,
+            "queued": self.queue.qsize(),
+            "max_queue": self.queue.maxsize,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "avg_batch_size": round(self.written / self.batches, 2) if self.batches else 0.0,
+            "write_errors": self.write_errors,
+        }
+
+
+activity_log = ActivityLogWriter()
+
+
+class ActivityLogFlushMiddleware:
+    """Sync mode: hold each response until the writer has written every queued event."""
+
+    def __init__(self, app, session_factory):
+        self.app = app
+        self.session_factory = session_factory
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_after_flush(message):
+            if message["type"] == "http.response.start":
+                await activity_log.flush(self.session_factory)
+            await send(message)
+
+        await self.app(scope, receive, send_after_flush)
+
+
+def record_activity(db, user_id, action, task_id, task_title):
+    """Record an audit event as part of db's transaction; returns its timestamp.
+
+    The event is held on the session and handed to the writer only if the
+    transaction commits, so rolled-back work is never logged.
+    """
+    row = {"user_id": user_id, "action": action, "task_id": task_id,
+           "task_title": task_title, "created_at": datetime.utcnow()}
+    db.info.setdefault(_PENDING_KEY, []).append(row)
+    return row["created_at"]
+
+
+@event.listens_for(Session, "after_commit")
+def _enqueue_committed(session):
+    rows = session.info.pop(_PENDING_KEY, None)
+    if rows:
+        activity_log.enqueue(rows)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -1,14 +1,137 @@
+import asyncio
 import hashlib
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Changing any of these makes existing hashes "need update"; they are then
+# transparently re-hashed on the user's next successful login.
+_argon2_settings = {}
+for _env, _key in (("ARGON2_TIME_COST", "argon2__rounds"),
+                   ("ARGON2_MEMORY_COST", "argon2__memory_cost"),
+                   ("ARGON2_PARALLELISM", "argon2__parallelism")):
+    if os.getenv(_env):
+        _argon2_settings[_key] = int(os.getenv(_env))
+# passlib only flags lower time costs as outdated when a minimum is configured
+if "argon2__rounds" in _argon2_settings:
+    _argon2_settings["argon2__min_rounds"] = _argon2_settings["argon2__rounds"]
 
-def get_password_hash(password):
+pwd_context = CryptContext(schemes=["argon2"], deprecated="auto", **_argon2_settings)
+
+HASH_POOL_KIND = os.getenv("HASH_POOL_KIND", "thread")  # thread | process
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Calls allowed to wait for a worker before we start rejecting with 503
+HASH_POOL_MAX_PENDING = int(os.getenv("HASH_POOL_MAX_PENDING", "32"))
+
+
+class HashPoolSaturated(Exception):
+    pass
+
+
+def _prehash(password):
     # Pre-hash with SHA256 to allow passwords > 72 bytes
-    hashed_sha256 = hashlib.sha256(password.encode()).hexdigest()
-    return pwd_context.hash(hashed_sha256)
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def get_password_hash(password):
+    return pwd_context.hash(_prehash(password))
 
 def verify_password(plain_password, hashed_password):
     # Pre-hash candidate with SHA256 before verifying
-    hashed_sha256 = hashlib.sha256(plain_password.encode()).hexdigest()
-    return pwd_context.verify(hashed_sha256, hashed_password)
+    return pwd_context.verify(_prehash(plain_password), hashed_password)
+
+def verify_and_update_password(plain_password, hashed_password):
+    # Returns (valid, new_hash); new_hash is set when the stored hash uses outdated parameters
+    return pwd_context.verify_and_update(_prehash(plain_password), hashed_password)
+
+
+# Worker entry points must be module-level so they can be pickled for the process pool
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def _hash_job(password):
+    return _timed(get_password_hash, password)
+
+def _verify_job(plain_password, hashed_password):
+    return _timed(verify_password, plain_password, hashed_password)
+
+def _verify_and_update_job(plain_password, hashed_password):
+    return _timed(verify_and_update_password, plain_password, hashed_password)
+
+
+class HashPool:
+    def __init__(self, kind=HASH_POOL_KIND, workers=HASH_POOL_WORKERS, max_pending=HASH_POOL_MAX_PENDING):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self._latencies = deque(maxlen=1024)  # (wait, run) seconds
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="argon2")
+        return self._executor
+
+    async def run(self, job, *args):
+        # Fail fast instead of letting a login burst queue up unboundedly
+        if self.in_flight >= self.workers + self.max_pending:
+            self.rejected += 1
+            raise HashPoolSaturated()
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, run_time = await loop.run_in_executor(self._get_executor(), job, *args)
+        finally:
+            self.in_flight -= 1
+        total = time.perf_counter() - start
+        self.completed += 1
+        self._latencies.append((max(total - run_time, 0.0), run_time))
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        def pct(values, q):
+            if not values:
+                return 0.0
+            return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+        waits = sorted(w for w, _ in self._latencies)
+        runs = sorted(r for _, r in self._latencies)
+        totals = sorted(w + r for w, r in self._latencies)
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_ms": {"p50": pct(waits, 0.5), "p95": pct(waits, 0.95), "p99": pct(waits, 0.99)},
+            "run_ms": {"p50": pct(runs, 0.5), "p95": pct(runs, 0.95), "p99": pct(runs, 0.99)},
+            "total_ms": {"p50": pct(totals, 0.5), "p95": pct(totals, 0.95), "p99": pct(totals, 0.99)},
+        }
+
+
+hash_pool = HashPool()
+
+async def get_password_hash_async(password):
+    return await hash_pool.run(_hash_job, password)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await hash_pool.run(_verify_job, plain_password, hashed_password)
+
+async def verify_and_update_password_async(plain_password, hashed_password):
+    return await hash_pool.run(_verify_and_update_job, plain_password, hashed_password)
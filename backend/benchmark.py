@@ -0,0 +1,323 @@
+"""Load benchmark for the hot API endpoints.
+
+Boots main.app in-process against a scratch database, seeds synthetic users,
+drives the endpoints from concurrent workers and prints a JSON report:
+
+    python benchmark.py --users 20 --tasks 500 --concurrency 16 --output bench.json
+    python benchmark.py --baseline bench.json   # exits 1 on a regression
+
+Requires httpx (pip install httpx).
+"""
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Scenario mix: name -> relative weight
+SCENARIOS = {
+    "list_tasks": 30,
+    "stats": 15,
+    "move_task": 15,
+    "reorder_tasks": 3,
+    "update_task": 10,
+    "note_layout": 15,
+    "note_content": 5,
+    "create_edge": 4,
+    "note_neighborhood": 4,
+    "login": 3,
+}
+PASSWORD = "benchmark-password"
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # scenario -> [(seconds, statements, commits, ok)]
+
+    def add(self, scenario, elapsed, response):
+        statements = commits = 0
+        header = response.headers.get("x-query-count")
+        if header:
+            count, _, rest = header.partition(";")
+            statements = int(count)
+            commits = int(rest.split("=")[1]) if "=" in rest else 0
+        ok = response.status_code < 400
+        self.samples.setdefault(scenario, []).append((elapsed, statements, commits, ok))
+
+    def report(self, wall_seconds):
+        endpoints = {}
+        for scenario, samples in sorted(self.samples.items()):
+            latencies = sorted(s[0] for s in samples)
+            n = len(samples)
+            endpoints[scenario] = {
+                "requests": n,
+                "errors": sum(1 for s in samples if not s[3]),
+                "throughput_rps": round(n / wall_seconds, 1),
+                "mean_ms": round(sum(latencies) / n * 1000, 2),
+                "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+                "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+                "statements_per_request": round(sum(s[1] for s in samples) / n, 2),
+                "commits_per_request": round(sum(s[2] for s in samples) / n, 2),
+            }
+        total = sum(e["requests"] for e in endpoints.values())
+        return {
+            "wall_seconds": round(wall_seconds, 2),
+            "total_requests": total,
+            "throughput_rps": round(total / wall_seconds, 1) if wall_seconds else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+async def seed(args, async_session):
+    """Bulk-insert users, tasks, activity logs, notes and edges; returns per-user fixtures."""
+    from models import User, Task, ActivityLog, StickyNote, NoteEdge
+    from auth_utils import get_password_hash
+    from ranking import spaced_ranks
+    from rollups import backfill_rollups
+
+    rng = random.Random(args.seed)
+    password_hash = get_password_hash(PASSWORD)  # one hash for everyone; hashing is slow by design
+    now = datetime.utcnow()
+    fixtures = []
+    # Login replaces a user's sessions, so the login scenario gets users of its own
+    login_users = [f"bench-login-{i}@example.com" for i in range(args.concurrency)]
+
+    async with async_session() as db:
+        for email in login_users:
+            db.add(User(user_id=f"user_{email.split('@')[0]}", email=email, name="Login", password_hash=password_hash))
+
+        for u in range(args.users):
+            user_id = f"user_bench{u:05d}"
+            db.add(User(user_id=user_id, email=f"bench{u}@example.com", name=f"Bench {u}", password_hash=password_hash))
+            task_ids = [f"task_b{u:05d}_{i:06d}" for i in range(args.tasks)]
+            tasks = []
+            for task_id, rank in zip(task_ids, spaced_ranks(args.tasks)):
+                completed = rng.random() < 0.5
+                completed_at = now - timedelta(days=rng.randint(0, 30), hours=rng.randint(0, 23)) if completed else None
+                tasks.append(Task(
+                    task_id=task_id, user_id=user_id, title=f"Task {task_id}", rank=rank,
+                    priority=rng.choice(["low", "medium", "high"]), category=rng.choice(["personal", "work"]),
+                    due_date=(now.date() + timedelta(days=rng.randint(-10, 10))).isoformat(),
+                    completed=completed, completed_at=completed_at,
+                ))
+            db.add_all(tasks)
+            db.add_all([
+                ActivityLog(user_id=user_id, action="completed", task_id=rng.choice(task_ids) if task_ids else "none",
+                            task_title="x", created_at=now - timedelta(days=rng.randint(0, 60)))
+                for _ in range(args.logs)
+            ])
+            note_ids = [f"note_b{u:05d}_{i:05d}" for i in range(args.notes)]
+            db.add_all([
+                StickyNote(note_id=note_id, user_id=user_id, content="note",
+                           x_position=rng.randint(0, 2000), y_position=rng.randint(0, 2000))
+                for note_id in note_ids
+            ])
+            # (source, target) is unique; workers add edges only between unconnected pairs
+            edge_pairs = set()
+            while len(note_ids) > 1 and len(edge_pairs) < min(args.edges, len(note_ids) * (len(note_ids) - 1) // 2):
+                edge_pairs.add(tuple(rng.sample(note_ids, 2)))
+            db.add_all([
+                NoteEdge(edge_id=f"edge_b{u:05d}_{i:06d}", user_id=user_id, source=source, target=target)
+                for i, (source, target) in enumerate(sorted(edge_pairs))
+            ])
+            fixtures.append({"email": f"bench{u}@example.com", "task_ids": task_ids, "note_ids": note_ids,
+                             "edge_pairs": edge_pairs})
+            await db.flush()
+        await db.commit()
+        await backfill_rollups(db)
+    return fixtures, login_users
+
+
+async def worker(index, client, fixture, login_email, args, recorder):
+    rng = random.Random(args.seed * 1000 + index)
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[n] for n in names]
+    task_ids = fixture["task_ids"]
+    note_ids = fixture["note_ids"]
+    headers = {"Authorization": f"Bearer {fixture['token']}"}
+
+    for _ in range(args.requests):
+        scenario = rng.choices(names, weights)[0]
+        if scenario in ("move_task", "reorder_tasks", "update_task") and len(task_ids) < 3:
+            continue
+        if (scenario.startswith("note_") and not note_ids) or (scenario == "create_edge" and len(note_ids) < 2):
+            continue
+
+        if scenario == "list_tasks":
+            call = client.get("/api/tasks", params={"limit": 50}, headers=headers)
+        elif scenario == "stats":
+            call = client.get("/api/stats", headers=headers)
+        elif scenario == "move_task":
+            # Neighbours from the list as it is now (untimed); earlier moves and
+            # reorders make the seeded order stale
+            listing = await client.get("/api/tasks", params={"limit": 50, "fields": "task_id"}, headers=headers)
+            order = [t["task_id"] for t in listing.json()]
+            i = rng.randrange(1, len(order) - 1)
+            moved = rng.choice(task_ids)
+            while moved in (order[i - 1], order[i + 1]):
+                moved = rng.choice(task_ids)
+            call = client.put(f"/api/tasks/{moved}/move", headers=headers,
+                              json={"after_task_id": order[i - 1], "before_task_id": order[i + 1]})
+        elif scenario == "reorder_tasks":
+            page = rng.sample(task_ids, min(50, len(task_ids)))
+            call = client.put("/api/tasks/reorder", headers=headers,
+                              json=[{"task_id": t, "order": i} for i, t in enumerate(page)])
+        elif scenario == "update_task":
+            call = client.put(f"/api/tasks/{rng.choice(task_ids)}", headers=headers,
+                              json={"completed": rng.random() < 0.5})
+        elif scenario == "note_layout":
+            call = client.put(f"/api/notes/{rng.choice(note_ids)}", headers=headers,
+                              json={"x_position": rng.randint(0, 2000), "y_position": rng.randint(0, 2000)})
+        elif scenario == "note_content":
+            call = client.put(f"/api/notes/{rng.choice(note_ids)}", headers=headers,
+                              json={"content": f"edited {rng.random():.6f}"})
+        elif scenario == "note_neighborhood":
+            call = client.get(f"/api/notes/{rng.choice(note_ids)}/neighborhood", params={"depth": 2}, headers=headers)
+        elif scenario == "create_edge":
+            for _ in range(20):
+                pair = tuple(rng.sample(note_ids, 2))
+                if pair not in fixture["edge_pairs"]:
+                    break
+            else:
+                continue
+            fixture["edge_pairs"].add(pair)
+            call = client.post("/api/edges", headers=headers, json={"source": pair[0], "target": pair[1]})
+        else:
+            call = client.post("/api/auth/login", json={"email": login_email, "password": PASSWORD})
+
+        start = time.perf_counter()
+        response = await call
+        recorder.add(scenario, time.perf_counter() - start, response)
+        # The session cookie from a login would take precedence over the bearer token
+        client.cookies.clear()
+
+
+def compare(report, baseline, tolerance, min_samples):
+    """Regressions of report against baseline: slower p95 beyond tolerance, or more statements."""
+    regressions = []
+    for name, current in report["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base:
+            continue
+        # p95 of a handful of requests is noise; statement counts are exact
+        enough = min(current["requests"], base["requests"]) >= min_samples
+        if enough and current["p95_ms"] > base["p95_ms"] * (1 + tolerance) and current["p95_ms"] - base["p95_ms"] > 1:
+            regressions.append(f"{name}: p95 {base['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current["statements_per_request"] > base["statements_per_request"] + 0.05:
+            regressions.append(
+                f"{name}: statements/request {base['statements_per_request']} -> {current['statements_per_request']}")
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {base['errors']} -> {current['errors']}")
+    return regressions
+
+
+async def run(args):
+    try:
+        import httpx
+    except ImportError:
+        sys.exit("benchmark.py needs httpx: pip install httpx")
+
+    import main
+    from database import engine, async_session
+
+    await main.on_startup()
+    try:
+        fixtures, login_users = await seed(args, async_session)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for fixture in fixtures:
+                response = await client.post("/api/auth/login", json={"email": fixture["email"], "password": PASSWORD})
+                response.raise_for_status()
+                fixture["token"] = response.cookies["session_token"]
+
+        # One client per worker so cookies never leak between them
+        clients = [httpx.AsyncClient(transport=transport, base_url="http://bench") for _ in range(args.concurrency)]
+        recorder = Recorder()
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*[
+                worker(i, clients[i], fixtures[i % len(fixtures)], login_users[i], args, recorder)
+                for i in range(args.concurrency)
+            ])
+        finally:
+            wall = time.perf_counter() - start
+            for client in clients:
+                await client.aclose()
+    finally:
+        await main.on_shutdown()
+        await engine.dispose()
+
+    report = recorder.report(wall)
+    report["config"] = {k: v for k, v in vars(args).items() if k not in ("baseline", "output", "database_url")}
+    report["config"]["database"] = (
+        engine.url.render_as_string(hide_password=True) if args.database_url else "sqlite (scratch file)"
+    )
+    return report
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark the Checktick API in-process")
+    parser.add_argument("--database-url", help="Empty database to benchmark against (default: a fresh SQLite file)")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--tasks", type=int, default=200, help="Tasks per user")
+    parser.add_argument("--logs", type=int, default=500, help="Activity log rows per user")
+    parser.add_argument("--notes", type=int, default=50, help="Sticky notes per user")
+    parser.add_argument("--edges", type=int, default=50, help="Note edges per user")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent workers")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per worker")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    parser.add_argument("--baseline", help="Compare against an earlier report; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 slowdown vs baseline (0.2 = 20%%)")
+    parser.add_argument("--min-samples", type=int, default=100,
+                        help="Only compare latency for scenarios with at least this many requests")
+    args = parser.parse_args()
+
+    if args.users < 1 or args.concurrency < 1:
+        parser.error("--users and --concurrency must be at least 1")
+
+    # Must be set before the app modules are imported
+    scratch = None
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(prefix="checktick-bench-", suffix=".db", delete=False)
+        scratch.close()
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{scratch.name}"
+    os.environ["QUERY_COUNT_HEADER"] = "1"
+
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if scratch is not None:
+            os.unlink(scratch.name)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.min_samples)
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    for line in regressions:
+        print(f"REGRESSION  {line}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main_cli()
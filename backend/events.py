@@ -0,0 +1,321 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from sqlmodel import select, delete, func
+from collections import deque
+from datetime import datetime, timedelta
+from models import ChangeEvent
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger("checktick.events")
+
+# Per-user change notifications for /api/events. bump_versions stages the
+# changed collections on the session; they are published only if the
+# transaction commits.
+# "memory": events fan out to this worker's streams only (single worker).
+# "database": each transaction also writes one ChangeEvent row and every
+# worker tails that table, so a stream on any worker sees every change.
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory")
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "100"))  # per stream; a stream further behind is dropped
+EVENTS_HISTORY_SIZE = int(os.getenv("EVENTS_HISTORY_SIZE", "10000"))  # memory backend: events kept for resuming
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+EVENTS_STREAM_MAX_AGE = float(os.getenv("EVENTS_STREAM_MAX_AGE", "900"))  # streams re-authenticate this often
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "1"))  # database backend
+EVENTS_RETENTION_MINUTES = int(os.getenv("EVENTS_RETENTION_MINUTES", "60"))
+EVENTS_PRUNE_INTERVAL = int(os.getenv("EVENTS_PRUNE_INTERVAL", "600"))
+EVENTS_RETRY_MS = 3000  # client reconnect delay
+EVENTS_REPLAY_LIMIT = 500  # a longer backlog is sent as a reset instead
+EVENTS_SETTLE_SECONDS = 10.0  # how long a gap in ChangeEvent ids may be a transaction still committing
+
+_PENDING_KEY = "pending_changes"
+
+
+def format_event(event_id, name, data):
+    return f"id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscription:
+    """One stream's bounded buffer of (event_id, collections); None marks the end."""
+
+    def __init__(self, user_id, token, max_size):
+        self.user_id = user_id
+        self.token = token
+        self.queue = asyncio.Queue(maxsize=max(max_size, 1))
+        self.closed = False
+
+    def offer(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            self.close()
+            return False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # Drop whatever is buffered so the end marker always fits; the client
+        # resumes from its Last-Event-ID
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class ChangeHub:
+    """In-process fan-out of change events to the streams open on this worker."""
+
+    def __init__(self, backend=EVENTS_BACKEND, buffer_size=EVENTS_BUFFER_SIZE, history_size=EVENTS_HISTORY_SIZE):
+        self.backend = backend
+        self.buffer_size = buffer_size
+        self._subscribers = {}  # user_id -> set of Subscription
+        # Memory ids start from the clock, so ids from before a restart fall
+        # below floor and resuming from them yields a reset
+        self.history = deque(maxlen=max(history_size, 1))  # (event_id, user_id, collections)
+        self.last_id = self.floor = int(time.time() * 1000)
+        self._seen = set()  # database backend: delivered ids above floor
+        self._stuck_since = None
+        self._task = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.resets = 0
+
+    # Publishing
+
+    def publish(self, user_id, collections):
+        """Memory backend: assign the next id, keep it for resuming and fan it out."""
+        self.last_id = max(self.last_id + 1, int(time.time() * 1000))
+        if len(self.history) == self.history.maxlen:
+            self.floor = self.history[0][0]
+        self.history.append((self.last_id, user_id, collections))
+        self._fan_out(self.last_id, user_id, collections)
+
+    def deliver(self, event_id, user_id, collections):
+        """Database backend: fan out a ChangeEvent row, once (committed locally or read by the tailer)."""
+        if event_id in self._seen:
+            return
+        if self._task is not None and event_id > self.floor:
+            self._seen.add(event_id)
+        self.last_id = max(self.last_id, event_id)
+        self._fan_out(event_id, user_id, collections)
+
+    def _fan_out(self, event_id, user_id, collections):
+        self.published += 1
+        for subscription in list(self._subscribers.get(user_id, ())):
+            if subscription.offer((event_id, collections)):
+                self.delivered += 1
+            else:
+                self.dropped += 1
+                logger.warning("Dropped a slow event stream for %s", user_id)
+
+    # Subscriptions
+
+    def subscribe(self, user_id, token):
+        subscription = Subscription(user_id, token, self.buffer_size)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self._subscribers.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.user_id]
+
+    def close_user(self, user_id):
+        for subscription in list(self._subscribers.get(user_id, ())):
+            subscription.close()
+
+    def close_token(self, token):
+        # Only this worker's streams; others end at EVENTS_STREAM_MAX_AGE
+        for subscriptions in list(self._subscribers.values()):
+            for subscription in list(subscriptions):
+                if subscription.token == token:
+                    subscription.close()
+
+    # Resuming
+
+    async def replay(self, session_factory, user_id, last_id):
+        """[(event_id, collections)] for user_id after last_id, or None if they cannot all be recovered."""
+        if self.backend == "database":
+            async with session_factory() as db:
+                low, high = (await db.exec(select(func.min(ChangeEvent.id), func.max(ChangeEvent.id)))).one()
+                if high is None:
+                    return [] if last_id == self.last_id else None
+                if not low - 1 <= last_id <= high:
+                    return None
+                rows = (await db.exec(
+                    select(ChangeEvent.id, ChangeEvent.collections)
+                    .where(ChangeEvent.user_id == user_id, ChangeEvent.id > last_id)
+                    .order_by(ChangeEvent.id)
+                    .limit(EVENTS_REPLAY_LIMIT + 1)
+                )).all()
+            events = [(event_id, collections.split(",")) for event_id, collections in rows]
+        else:
+            if not self.floor <= last_id <= self.last_id:
+                return None
+            events = [(event_id, collections) for event_id, uid, collections in self.history
+                      if uid == user_id and event_id > last_id]
+        return events if len(events) <= EVENTS_REPLAY_LIMIT else None
+
+    async def stream(self, session_factory, user_id, token, last_id=None):
+        """SSE body for one client: a ready (or replayed, or reset) opening, then
+        change events and heartbeats until the stream is closed or too old."""
+        subscription = self.subscribe(user_id, token)
+        try:
+            # Subscribed first, so nothing committed during the replay is missed
+            backlog = [] if last_id is None else await self.replay(session_factory, user_id, last_id)
+            opening = f"retry: {EVENTS_RETRY_MS}\n\n"
+            if last_id is None:
+                opening += format_event(self.last_id, "ready", {})
+            elif backlog is None:
+                self.resets += 1
+                opening += format_event(self.last_id, "reset", {})
+                backlog = []
+            replayed = set()
+            for event_id, collections in backlog:
+                replayed.add(event_id)
+                opening += format_event(event_id, "change", {"collections": collections})
+            yield opening
+
+            deadline = time.monotonic() + EVENTS_STREAM_MAX_AGE
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(subscription.queue.get(), min(EVENTS_HEARTBEAT, remaining))
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if item is None:
+                    break
+                if item[0] in replayed:
+                    continue
+                yield format_event(item[0], "change", {"collections": item[1]})
+        finally:
+            self.unsubscribe(subscription)
+
+    # Database backend tailer
+
+    async def _poll(self, session_factory):
+        async with session_factory() as db:
+            rows = (await db.exec(
+                select(ChangeEvent.id, ChangeEvent.user_id, ChangeEvent.collections)
+                .where(ChangeEvent.id > self.floor)
+                .order_by(ChangeEvent.id)
+                .limit(1000)
+            )).all()
+        for event_id, user_id, collections in rows:
+            self.deliver(event_id, user_id, collections.split(","))
+        self._advance()
+
+    def _advance(self):
+        # Ids are assigned at insert but become visible at commit, so a gap may
+        # still fill in; give up on it (a rolled-back insert) after a while
+        while self.floor + 1 in self._seen:
+            self.floor += 1
+            self._seen.discard(self.floor)
+        if not self._seen:
+            self._stuck_since = None
+        elif self._stuck_since is None:
+            self._stuck_since = time.monotonic()
+        elif time.monotonic() - self._stuck_since > EVENTS_SETTLE_SECONDS:
+            self.floor = min(self._seen) - 1
+            self._stuck_since = None
+            self._advance()
+
+    async def _tail(self, session_factory):
+        while True:
+            try:
+                await self._poll(session_factory)
+            except Exception:
+                logger.exception("Could not read change events")
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+
+    async def start(self, session_factory):
+        if self.backend != "database" or self._task is not None:
+            return
+        async with session_factory() as db:
+            latest = (await db.exec(select(func.max(ChangeEvent.id)))).one()
+        self.last_id = self.floor = latest or 0
+        self._task = asyncio.create_task(self._tail(session_factory))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for subscriptions in list(self._subscribers.values()):
+            for subscription in list(subscriptions):
+                subscription.close()
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "streams": sum(len(s) for s in self._subscribers.values()),
+            "users": len(self._subscribers),
+            "last_id": self.last_id,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "resets": self.resets,
+        }
+
+
+change_hub = ChangeHub()
+
+
+def stage_change(db, user_id, collections):
+    """Notify user_id's streams of changed collections once db's transaction commits."""
+    pending = db.info.setdefault(_PENDING_KEY, {})
+    entry = pending.get(user_id)
+    if entry is None:
+        row = None
+        if change_hub.backend == "database":
+            row = ChangeEvent(user_id=user_id, collections="")
+            db.add(row)
+        entry = pending[user_id] = (set(), row)
+    names, row = entry
+    names.update(collections)
+    if row is not None:
+        row.collections = ",".join(sorted(names))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    for user_id, (names, row) in (pending or {}).items():
+        if row is None:
+            change_hub.publish(user_id, sorted(names))
+        else:
+            # The identity survives expire-on-commit, so reading it never hits the database
+            change_hub.deliver(inspect(row).identity[0], user_id, sorted(names))
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+async def prune_change_events(db, retention_minutes=EVENTS_RETENTION_MINUTES, batch_size=1000):
+    """Scheduled job: delete ChangeEvent rows older than the retention window."""
+    cutoff = datetime.utcnow() - timedelta(minutes=retention_minutes)
+    removed = 0
+    while True:
+        ids = (await db.exec(
+            select(ChangeEvent.id).where(ChangeEvent.created_at < cutoff)
+            .order_by(ChangeEvent.created_at).limit(batch_size)
+        )).all()
+        if not ids:
+            break
+        await db.exec(delete(ChangeEvent).where(ChangeEvent.id.in_(ids)))
+        await db.commit()
+        removed += len(ids)
+    return removed
@@ -0,0 +1,97 @@
+from collections import OrderedDict, deque
+from sqlmodel import select
+from models import NoteEdge
+from versions import get_versions
+import os
+
+GRAPH_CACHE_SIZE = int(os.getenv("GRAPH_CACHE_SIZE", "1000"))  # users
+GRAPH_MAX_DEPTH = 10
+GRAPH_MAX_NOTES = int(os.getenv("GRAPH_MAX_NOTES", "500"))  # per neighborhood/component response
+
+
+class Adjacency:
+    """One user's note graph, undirected: note_id -> {neighbor note_id: [edge_id, ...]}."""
+
+    def __init__(self, edges):
+        self.neighbors = {}
+        for edge_id, source, target in edges:
+            self.neighbors.setdefault(source, {}).setdefault(target, []).append(edge_id)
+            self.neighbors.setdefault(target, {}).setdefault(source, []).append(edge_id)
+
+    def walk(self, start, max_depth=None, max_notes=GRAPH_MAX_NOTES):
+        """Breadth-first from start, up to max_depth hops (None: the whole component).
+
+        Returns (note_ids, edge_ids, frontier). Edges join two returned notes;
+        the frontier holds returned notes with neighbors left unvisited, where
+        a client can continue loading.
+        """
+        depth = {start: 0}
+        queue = deque([start])
+        frontier = set()
+        while queue:
+            note = queue.popleft()
+            for neighbor in self.neighbors.get(note, {}):
+                if neighbor in depth:
+                    continue
+                if (max_depth is not None and depth[note] >= max_depth) or len(depth) >= max_notes:
+                    frontier.add(note)
+                    continue
+                depth[neighbor] = depth[note] + 1
+                queue.append(neighbor)
+        edge_ids = {
+            edge_id
+            for note in depth
+            for neighbor, ids in self.neighbors.get(note, {}).items()
+            if neighbor in depth
+            for edge_id in ids
+        }
+        return list(depth), sorted(edge_ids), sorted(frontier)
+
+
+class GraphCache:
+    """Per-process LRU of user_id -> Adjacency, tagged with the user's "edges" version.
+
+    Every edge mutation (and note deletion) bumps that version, so a stale
+    entry is detected with one primary-key read and rebuilt from NoteEdge;
+    this also keeps workers consistent without cross-process invalidation.
+    """
+
+    def __init__(self, max_size: int = GRAPH_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # user_id -> (version, Adjacency)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, db, user_id):
+        # Version first: an edge committed after this read yields a newer graph under
+        # the older version, which the next request rebuilds, never the reverse
+        (version,) = await get_versions(db, user_id, "edges")
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        result = await db.exec(
+            select(NoteEdge.edge_id, NoteEdge.source, NoteEdge.target).where(NoteEdge.user_id == user_id)
+        )
+        adjacency = Adjacency(result.all())
+        if self.max_size > 0:
+            self._entries[user_id] = (version, adjacency)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return adjacency
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+graph_cache = GraphCache()
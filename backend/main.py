@@ -1,16 +1,42 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Response
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, BackgroundTasks, Query
 from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlmodel import SQLModel, select, func, and_, delete
-from datetime import datetime, timedelta, timezone
-from database import init_db, get_session
-from models import User, Task, ActivityLog, PomodoroSession, UserSession, StickyNote, NoteEdge
-from auth_utils import get_password_hash, verify_password
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from sqlmodel import SQLModel, select, func, and_, delete, update, case
+from sqlalchemy.exc import IntegrityError, DataError
+from datetime import datetime, timedelta, timezone, date
+from database import (
+    init_db, get_session, get_read_session, use_primary, async_session, pool_status,
+    replica_engine, replica_monitor, ReadYourWritesMiddleware,
+)
+from models import User, Task, PomodoroSession, UserSession, StickyNote, NoteEdge, DailyRollup
+from rollups import bump_rollup, rollup_day
+from ranking import rank_between, needs_rebalance, apply_ranks, rebalance_ranks
+from pagination import paginate, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from versions import bump_versions, check_not_modified
+from sync import collect_changes, encode_sync_cursor, decode_sync_cursor
+import mutations
+from note_buffer import note_buffer
+from subtasks import load_subtasks, subtask_dict
+from recurrence import materialize_for_user
+from graph import graph_cache, GRAPH_MAX_DEPTH
+from search import search, SEARCH_LIMIT
+from workspace import export_workspace, import_workspace
+import query_counter
+from metrics import MetricsMiddleware, render_metrics, slow_queries, require_metrics_token
+from activity_log import activity_log, ActivityLogFlushMiddleware, ACTIVITY_LOG_MODE
+from events import change_hub
+from scheduler import scheduler
+from maintenance import register_jobs
+import logging
+from auth_utils import (
+    hash_pool, HashPoolSaturated, get_password_hash_async, verify_password_async,
+    verify_and_update_password_async,
+)
+from session_cache import session_cache
+from pydantic import BaseModel, Field, ValidationError, field_validator
 import uuid
 import json
-import os
 
 # Schemas
 class LoginRequest(BaseModel):
@@ -26,18 +52,71 @@ class ChangePasswordRequest(BaseModel):
     current_password: str
     new_password: str
 
-def task_to_dict(task: Task):
-    d = task.dict()
-    if d.get("subtasks"):
-        try:
-            d["subtasks"] = json.loads(d["subtasks"])
-        except:
-            d["subtasks"] = []
-    else:
-        d["subtasks"] = []
+class TaskMoveRequest(BaseModel):
+    # Neighbours after the move; None means the start/end of the list
+    after_task_id: Optional[str] = None
+    before_task_id: Optional[str] = None
+
+class SubtaskCreate(BaseModel):
+    id: Optional[str] = Field(None, max_length=64)
+    title: str
+    completed: bool = False
+
+class SubtaskUpdate(BaseModel):
+    title: Optional[str] = None
+    completed: Optional[bool] = None
+
+    @field_validator("*")
+    @classmethod
+    def not_null(cls, value):
+        # Omit a field to leave it unchanged; both columns are NOT NULL
+        if value is None:
+            raise ValueError("must not be null")
+        return value
+
+class SubtaskReorderRequest(BaseModel):
+    subtask_ids: list[str]
+
+# Response models let FastAPI serialize with pydantic-core instead of
+# jsonable_encoder; ORJSONResponse (the app default) then renders the bytes
+class SubtaskOut(BaseModel):
+    id: str
+    title: str
+    completed: bool
+
+class TaskOut(BaseModel):
+    task_id: str
+    user_id: str
+    title: str
+    description: Optional[str] = None
+    priority: str
+    category: str
+    due_date: Optional[str] = None
+    completed: bool
+    order: int
+    rank: str
+    recurring: Optional[str] = None
+    series_id: Optional[str] = None
+    series_start: Optional[str] = None
+    next_due: Optional[str] = None
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    subtasks: list[SubtaskOut] = []
+
+TASK_OUT_COLUMNS = [field for field in TaskOut.model_fields if field != "subtasks"]
+
+def task_to_dict(task: Task, subtasks=None):
+    # subtasks come from load_subtasks; the legacy JSON column is not exposed
+    d = {field: getattr(task, field) for field in TASK_OUT_COLUMNS}
+    d["subtasks"] = subtasks or []
     return d
 
-app = FastAPI(title="Checktick API")
+async def tasks_to_dicts(db, tasks):
+    subtasks = await load_subtasks(db, [t.task_id for t in tasks])
+    return [task_to_dict(t, subtasks[t.task_id]) for t in tasks]
+
+app = FastAPI(title="Checktick API", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,28 +124,71 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", query_counter.QUERY_COUNT_HEADER_NAME],
 )
+app.add_middleware(MetricsMiddleware)
+if query_counter.QUERY_COUNT_HEADER:
+    app.add_middleware(query_counter.QueryCountMiddleware)
+if replica_engine is not None:
+    app.add_middleware(ReadYourWritesMiddleware)
+if ACTIVITY_LOG_MODE == "sync":
+    app.add_middleware(ActivityLogFlushMiddleware, session_factory=async_session)
+
+logger = logging.getLogger("checktick")
+
+register_jobs(scheduler)
 
 @app.on_event("startup")
 async def on_startup():
     await init_db()
-
-# Helper: Get current user from session token
-async def get_current_user(request: Request, db=Depends(get_session)):
+    replica_monitor.start()
+    scheduler.start(async_session)
+    note_buffer.start(async_session)
+    activity_log.start(async_session)
+    await change_hub.start(async_session)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await change_hub.stop()
+    await replica_monitor.stop()
+    await scheduler.stop()
+    await note_buffer.stop(async_session)
+    await activity_log.stop(async_session)
+    hash_pool.shutdown()
+
+@app.exception_handler(HashPoolSaturated)
+async def hash_pool_saturated_handler(request: Request, exc: HashPoolSaturated):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, please retry"}, headers={"Retry-After": "1"})
+
+def get_session_token(request: Request):
     session_token = request.cookies.get("session_token")
     if not session_token:
         auth_header = request.headers.get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
             session_token = auth_header.split(" ")[1]
+    return session_token
 
+# Helper: Get current user from session token
+async def get_current_user(request: Request, db=Depends(get_session)):
+    session_token = get_session_token(request)
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    stmt = select(UserSession).where(UserSession.session_token == session_token)
+    cached = session_cache.get(session_token)
+    if cached is not None:
+        return User(**cached)
+
+    # Session and user in one round trip
+    stmt = (
+        select(UserSession, User)
+        .join(User, User.user_id == UserSession.user_id, isouter=True)
+        .where(UserSession.session_token == session_token)
+    )
     result = await db.exec(stmt)
-    session = result.first()
-    if not session:
+    row = result.first()
+    if not row:
         raise HTTPException(status_code=401, detail="Invalid or expired session")
+    session, user = row
 
     # Handle naive datetime from DB (asyncmy returns naive)
     expires_at = session.expires_at
@@ -76,11 +198,10 @@ async def get_current_user(request: Request, db=Depends(get_session)):
     if expires_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Invalid or expired session")
 
-    user_stmt = select(User).where(User.user_id == session.user_id)
-    user_result = await db.exec(user_stmt)
-    user = user_result.first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+
+    session_cache.set(session_token, user.user_id, user.dict(), expires_at)
     return user
 
 # Auth Routes
@@ -94,7 +215,7 @@ async def register(data: RegisterRequest, db=Depends(get_session)):
         raise HTTPException(status_code=400, detail="Email already registered")
 
     user_id = f"user_{uuid.uuid4().hex[:12]}"
-    hashed_password = get_password_hash(data.password)
+    hashed_password = await get_password_hash_async(data.password)
     
     new_user = User(
         user_id=user_id,
@@ -113,9 +234,16 @@ async def login(data: LoginRequest, response: Response, db=Depends(get_session))
     result = await db.exec(stmt)
     user = result.first()
     
-    if not user or not verify_password(data.password, user.password_hash):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await verify_and_update_password_async(data.password, user.password_hash)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    # Hashing parameters changed since this hash was made: upgrade it
+    if new_hash:
+        user.password_hash = new_hash
+
     # Create Session
     session_token = f"st_{uuid.uuid4().hex}"
     expires_at = datetime.now(timezone.utc) + timedelta(days=7)
@@ -123,6 +251,8 @@ async def login(data: LoginRequest, response: Response, db=Depends(get_session))
     # Delete old sessions
     stmt = delete(UserSession).where(UserSession.user_id == user.user_id)
     await db.exec(stmt)
+    session_cache.invalidate_user(user.user_id)
+    change_hub.close_user(user.user_id)
 
     new_session = UserSession(
         session_token=session_token,
@@ -155,184 +285,295 @@ async def logout(request: Request, response: Response, db=Depends(get_session)):
         stmt = delete(UserSession).where(UserSession.session_token == session_token)
         await db.exec(stmt)
         await db.commit()
+        session_cache.invalidate(session_token)
+        change_hub.close_token(session_token)
     response.delete_cookie("session_token")
     return {"message": "Logged out"}
 
 @app.post("/api/auth/change-password")
 async def change_password(data: ChangePasswordRequest, user: User = Depends(get_current_user), db=Depends(get_session)):
     # Verify current password
-    if not verify_password(data.current_password, user.password_hash):
+    if not await verify_password_async(data.current_password, user.password_hash):
         raise HTTPException(status_code=400, detail="Incorrect current password")
     
     # Update to new password
-    hashed_password = get_password_hash(data.new_password)
-    user.password_hash = hashed_password
-    db.add(user)
+    # The user may come from the session cache (detached), so update by key
+    hashed_password = await get_password_hash_async(data.new_password)
+    await db.exec(update(User).where(User.user_id == user.user_id).values(password_hash=hashed_password))
     await db.commit()
+    session_cache.invalidate_user(user.user_id)
+    change_hub.close_user(user.user_id)
     
     return {"message": "Password updated successfully"}
 
 # Task Routes
-@app.get("/api/tasks")
-async def get_tasks(user: User = Depends(get_current_user), db=Depends(get_session)):
-    stmt = select(Task).where(Task.user_id == user.user_id).order_by(Task.order)
-    result = await db.exec(stmt)
-    tasks = result.all()
-    return [task_to_dict(t) for t in tasks]
-
-@app.post("/api/tasks")
+TASK_FIELDS = set(Task.__fields__)
+
+async def materialize_recurring(db, user_id, until: date):
+    # Occurrences due by `until` are created on read, before the ETag is computed.
+    # db is a read session, so the writes go through a primary session, and
+    # the rest of the request then reads from the primary too
+    async with async_session() as write_db:
+        if await materialize_for_user(write_db, user_id, until):
+            await write_db.commit()
+            await use_primary(db)
+
+@app.get("/api/tasks", response_model=list[TaskOut])
+async def get_tasks(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    completed: Optional[bool] = None,
+    category: Optional[str] = None,
+    priority: Optional[str] = None,
+    due_from: Optional[str] = None,  # YYYY-MM-DD, inclusive
+    due_to: Optional[str] = None,  # YYYY-MM-DD, inclusive
+    fields: Optional[str] = None,  # comma-separated projection, e.g. "task_id,title,completed"
+    user: User = Depends(get_current_user),
+    db=Depends(get_read_session),
+):
+    if due_to is not None:
+        try:
+            await materialize_recurring(db, user.user_id, date.fromisoformat(due_to))
+        except ValueError:
+            pass  # not a date; the string comparison below still applies
+
+    not_modified = await check_not_modified(request, response, db, user.user_id, "tasks")
+    if not_modified:
+        return not_modified
+
+    order_columns = [Task.rank, Task.task_id]
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = set(requested) - TASK_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        # The ordering key is always loaded so the next cursor can be built
+        # Subtasks live in their own table and are attached below
+        selected = list(dict.fromkeys(["task_id", *[f for f in requested if f != "subtasks"], "rank"]))
+        stmt = select(*[getattr(Task, f) for f in selected])
+    else:
+        requested = None
+        stmt = select(Task)
+
+    stmt = stmt.where(Task.user_id == user.user_id)
+    if completed is not None:
+        stmt = stmt.where(Task.completed == completed)
+    if category is not None:
+        stmt = stmt.where(Task.category == category)
+    if priority is not None:
+        stmt = stmt.where(Task.priority == priority)
+    if due_from is not None:
+        stmt = stmt.where(Task.due_date >= due_from)
+    if due_to is not None:
+        stmt = stmt.where(Task.due_date <= due_to)
+
+    rows = await paginate(db, stmt, order_columns, limit, cursor, response)
+    if requested is None:
+        return await tasks_to_dicts(db, rows)
+    keep = [f for f in ["task_id", *requested] if f != "subtasks"]
+    items = [{f: row._mapping[f] for f in keep} for row in rows]
+    if "subtasks" in requested:
+        subtasks = await load_subtasks(db, [item["task_id"] for item in items])
+        for item in items:
+            item["subtasks"] = subtasks[item["task_id"]]
+    # Partial items do not fit TaskOut; returned as is, with the ETag and cursor headers
+    return ORJSONResponse(items, headers=dict(response.headers))
+
+@app.post("/api/tasks", response_model=TaskOut)
 async def create_task(task_data: dict, user: User = Depends(get_current_user), db=Depends(get_session)):
-    max_stmt = select(func.max(Task.order)).where(Task.user_id == user.user_id)
-    max_result = await db.exec(max_stmt)
-    max_order = max_result.one() or -1
-
-    new_task = Task(
-        task_id=f"task_{uuid.uuid4().hex[:12]}",
-        user_id=user.user_id,
-        order=max_order + 1,
-        subtasks=json.dumps(task_data.get("subtasks", [])),
-        **{k: v for k, v in task_data.items() if k != "subtasks"}
-    )
-    db.add(new_task)
+    new_task = await mutations.create_task(db, user.user_id, task_data)
+    # Built before the commit, so nothing is read back afterwards
+    body = (await tasks_to_dicts(db, [new_task]))[0]
     await db.commit()
-    await db.refresh(new_task)
+    return body
 
-    # Log activity
-    log = ActivityLog(user_id=user.user_id, action="created", task_id=new_task.task_id, task_title=new_task.title)
-    db.add(log)
+# Declared before /api/tasks/{task_id} so "reorder" is not taken for a task id
+@app.put("/api/tasks/reorder")
+async def reorder_tasks(orders: list[dict], user: User = Depends(get_current_user), db=Depends(get_session)):
+    # Full reorder from the client: respace ranks in the given order with one bulk UPDATE
+    ordered = sorted(orders, key=lambda item: item.get("order", 0))
+    task_ids = list(dict.fromkeys(item["task_id"] for item in ordered))
+    await apply_ranks(db, user.user_id, task_ids)
+    await bump_versions(db, user.user_id, "tasks")
     await db.commit()
+    return {"message": "Reordered"}
 
-    return task_to_dict(new_task)
-
-@app.put("/api/tasks/{task_id}")
-async def update_task(task_id: str, task_data: dict, user: User = Depends(get_current_user), db=Depends(get_session)):
-    stmt = select(Task).where(Task.task_id == task_id, Task.user_id == user.user_id)
-    result = await db.exec(stmt)
-    task = result.first()
-    if not task:
+async def _rebalance_in_background(user_id: str):
+    async with async_session() as db:
+        await rebalance_ranks(db, user_id)
+
+@app.put("/api/tasks/{task_id}/move")
+async def move_task(task_id: str, data: TaskMoveRequest, background_tasks: BackgroundTasks, user: User = Depends(get_current_user), db=Depends(get_session)):
+    if not data.after_task_id and not data.before_task_id:
+        raise HTTPException(status_code=400, detail="after_task_id or before_task_id is required")
+    if task_id in (data.after_task_id, data.before_task_id):
+        raise HTTPException(status_code=400, detail="A task cannot be moved next to itself")
+    neighbour_ids = [i for i in (task_id, data.after_task_id, data.before_task_id) if i]
+    result = await db.exec(
+        select(Task.task_id, Task.rank).where(Task.user_id == user.user_id, Task.task_id.in_(neighbour_ids))
+    )
+    ranks = dict(result.all())
+    if any(i not in ranks for i in neighbour_ids):
         raise HTTPException(status_code=404, detail="Task not found")
 
-    # Capture previous state
-    was_not_completed = not task.completed
-    
-    for key, value in task_data.items():
-        if key == "subtasks":
-            setattr(task, key, json.dumps(value))
-        else:
-            setattr(task, key, value)
+    after_rank = ranks.get(data.after_task_id)
+    before_rank = ranks.get(data.before_task_id)
+    try:
+        new_rank = rank_between(after_rank, before_rank)
+    except ValueError:
+        # Neighbours share a rank (or are out of order): respace the list and retry
+        await rebalance_ranks(db, user.user_id)
+        result = await db.exec(
+            select(Task.task_id, Task.rank).where(Task.user_id == user.user_id, Task.task_id.in_(neighbour_ids))
+        )
+        ranks = dict(result.all())
+        try:
+            new_rank = rank_between(ranks.get(data.after_task_id), ranks.get(data.before_task_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid move")
 
-    # Check if newly completed
-    if task_data.get("completed") and was_not_completed:
-        task.completed_at = datetime.utcnow()
-        log = ActivityLog(user_id=user.user_id, action="completed", task_id=task_id, task_title=task.title)
-        db.add(log)
+    await db.exec(
+        update(Task).where(Task.task_id == task_id, Task.user_id == user.user_id)
+        .values(rank=new_rank, updated_at=datetime.utcnow())
+    )
+    await bump_versions(db, user.user_id, "tasks")
+    await db.commit()
+    if needs_rebalance(new_rank):
+        background_tasks.add_task(_rebalance_in_background, user.user_id)
+    return {"task_id": task_id, "rank": new_rank}
 
+@app.put("/api/tasks/{task_id}", response_model=TaskOut)
+async def update_task(task_id: str, task_data: dict, user: User = Depends(get_current_user), db=Depends(get_session)):
+    task = await mutations.update_task(db, user.user_id, task_id, task_data)
+    body = (await tasks_to_dicts(db, [task]))[0]
     await db.commit()
-    await db.refresh(task)
-    return task_to_dict(task)
+    return body
 
 @app.delete("/api/tasks/{task_id}")
 async def delete_task(task_id: str, user: User = Depends(get_current_user), db=Depends(get_session)):
-    stmt = select(Task).where(Task.task_id == task_id, Task.user_id == user.user_id)
-    result = await db.exec(stmt)
-    task = result.first()
-    if not task:
-        raise HTTPException(status_code=404)
-
-    await db.delete(task)
+    await mutations.delete_task(db, user.user_id, task_id)
     await db.commit()
     return {"message": "Task deleted"}
 
-@app.put("/api/tasks/reorder")
-async def reorder_tasks(orders: list[dict], user: User = Depends(get_current_user), db=Depends(get_session)):
-    for item in orders:
-        stmt = select(Task).where(Task.task_id == item["task_id"], Task.user_id == user.user_id)
-        result = await db.exec(stmt)
-        task = result.first()
-        if task:
-            task.order = item["order"]
-            db.add(task)
+# Subtasks: single-item changes without resending the task
+@app.post("/api/tasks/{task_id}/subtasks", response_model=SubtaskOut)
+async def create_subtask(task_id: str, data: SubtaskCreate, user: User = Depends(get_current_user), db=Depends(get_session)):
+    subtask = await mutations.create_subtask(db, user.user_id, task_id, data.dict())
     await db.commit()
-    return {"message": "Reordered"}
+    return subtask_dict(subtask)
+
+# Declared before /{subtask_id} so "reorder" is not taken for a subtask id
+@app.put("/api/tasks/{task_id}/subtasks/reorder", response_model=list[SubtaskOut])
+async def reorder_subtasks(task_id: str, data: SubtaskReorderRequest, user: User = Depends(get_current_user), db=Depends(get_session)):
+    await mutations.reorder_subtasks(db, user.user_id, task_id, data.subtask_ids)
+    await db.commit()
+    return (await load_subtasks(db, [task_id]))[task_id]
+
+@app.put("/api/tasks/{task_id}/subtasks/{subtask_id}", response_model=SubtaskOut)
+async def update_subtask(task_id: str, subtask_id: str, data: SubtaskUpdate, user: User = Depends(get_current_user), db=Depends(get_session)):
+    subtask = await mutations.update_subtask(db, user.user_id, task_id, subtask_id, data.dict(exclude_unset=True))
+    await db.commit()
+    return subtask_dict(subtask)
+
+@app.delete("/api/tasks/{task_id}/subtasks/{subtask_id}")
+async def delete_subtask(task_id: str, subtask_id: str, user: User = Depends(get_current_user), db=Depends(get_session)):
+    await mutations.delete_subtask(db, user.user_id, task_id, subtask_id)
+    await db.commit()
+    return {"message": "Subtask deleted"}
+
+# Search
+@app.get("/api/search")
+async def search_items(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    kind: Optional[str] = Query(None, pattern="^(task|note)$"),  # default: both
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=100),
+    user: User = Depends(get_current_user),
+    db=Depends(get_read_session),
+):
+    not_modified = await check_not_modified(request, response, db, user.user_id, "tasks", "notes")
+    if not_modified:
+        return not_modified
+    hits = await search(db, user.user_id, q, (kind,) if kind else ("task", "note"), limit)
+
+    items = {}
+    task_ids = [entity_id for k, entity_id, _ in hits if k == "task"]
+    if task_ids:
+        tasks = (await db.exec(select(Task).where(Task.user_id == user.user_id, Task.task_id.in_(task_ids)))).all()
+        for data in await tasks_to_dicts(db, tasks):
+            items["task", data["task_id"]] = data
+    note_ids = [entity_id for k, entity_id, _ in hits if k == "note"]
+    if note_ids:
+        notes = await db.exec(select(StickyNote).where(StickyNote.user_id == user.user_id, StickyNote.note_id.in_(note_ids)))
+        for note in notes.all():
+            items["note", note.note_id] = note_buffer.overlay(note)
+    return [
+        {"kind": k, "score": score, "item": items[k, entity_id]}
+        for k, entity_id, score in hits
+        if (k, entity_id) in items
+    ]
 
 # Stats
 @app.get("/api/stats")
-async def get_stats(user: User = Depends(get_current_user), db=Depends(get_session)):
-    today = datetime.utcnow().date().isoformat()
-
-    # Result Unpacking Helper for func.count (asyncmy returns tuple/row)
-    async def get_count(stmt):
-        result = await db.exec(stmt)
-        row = result.first()
-        if row:
-            # SQLModel/SQLAlchemy returns value directly or tuple depending on version/driver
-            # For robustness, handle both
-            return row if isinstance(row, int) else row[0]
-        return 0
-
-    total = await get_count(select(func.count(Task.task_id)).where(Task.user_id == user.user_id))
-    completed = await get_count(select(func.count(Task.task_id)).where(and_(Task.user_id == user.user_id, Task.completed)))
-    today_tasks = await get_count(select(func.count(Task.task_id)).where(and_(Task.user_id == user.user_id, Task.due_date == today)))
-    today_completed = await get_count(select(func.count(Task.task_id)).where(and_(Task.user_id == user.user_id, Task.due_date == today, Task.completed)))
-
-    # Simple streak (days with at least one completion)
-    logs = await db.exec(select(ActivityLog.created_at).where(and_(ActivityLog.user_id == user.user_id, ActivityLog.action == "completed")).order_by(ActivityLog.created_at.desc()))
-    dates = [log.date() for log in logs] # log is already datetime from ActivityLog model
+async def get_stats(request: Request, response: Response, user: User = Depends(get_current_user), db=Depends(get_read_session)):
+    current_date = datetime.utcnow().date()
+    today = current_date.isoformat()
+
+    # Stats only change with tasks, pomodoros or the date
+    not_modified = await check_not_modified(request, response, db, user.user_id, "tasks", "pomodoro", extra=(today,))
+    if not_modified:
+        return not_modified
+
+    # Totals plus the lifetime pomodoro count (summed from the daily rollup)
+    pomodoro_count_sq = (
+        select(func.sum(DailyRollup.pomodoro_count))
+        .where(DailyRollup.user_id == user.user_id)
+        .scalar_subquery()
+    )
+    totals_stmt = select(
+        func.count(Task.task_id),
+        func.sum(case((Task.completed == True, 1), else_=0)),
+        func.sum(case((Task.due_date == today, 1), else_=0)),
+        func.sum(case((and_(Task.due_date == today, Task.completed == True), 1), else_=0)),
+        pomodoro_count_sq,
+    ).where(Task.user_id == user.user_id)
+    totals_row = (await db.exec(totals_stmt)).first()
+    total, completed, today_tasks, today_completed, pomodoro_count = [int(v or 0) for v in totals_row]
+
+    # Find start of this week (Monday)
+    this_week_start = current_date - timedelta(days=current_date.weekday())
+    last_week_start = this_week_start - timedelta(days=7)
+
+    # One rollup row per active day covers both the streak window and the two charted weeks
+    window_start = min(current_date - timedelta(days=366), last_week_start)
+    rollup_result = await db.exec(
+        select(DailyRollup.day, DailyRollup.completed_count, DailyRollup.completion_events)
+        .where(and_(DailyRollup.user_id == user.user_id, DailyRollup.day >= window_start))
+    )
+    per_day = {}
+    active_days = set()
+    for day, completed_count, completion_events in rollup_result.all():
+        per_day[day] = completed_count
+        if completion_events > 0:
+            active_days.add(day)
+
+    # Streak: consecutive days with a completion, ending today (at most 366 days)
     streak = 0
-    check_date = datetime.utcnow().date()
-    # Unique dates set for faster lookup and correctness (multiple logs same day)
-    unique_dates = set(dates)
-    
-    # Check streak starting from today or yesterday
-    if check_date in unique_dates:
+    check_date = current_date
+    while streak < 366 and check_date in active_days:
         streak += 1
         check_date -= timedelta(days=1)
-    
-    # Simple loop to count consecutive days
-    for i in range(365):
-        if check_date in unique_dates:
-            streak += 1
-            check_date -= timedelta(days=1)
-        else:
-            if streak > 0: # If we already started counting and hit a miss, stop
-                break
-            # If we haven't started (today wasn't done), check if yesterday was done to start streak?
-            # Simplified: just count backwards from today
-            pass
-
-    # Weekly Data Helper
-    async def get_week_data(start_date):
+
+    def week_data(start_date):
         data = []
         for i in range(7):
             target_date = start_date + timedelta(days=i)
-            day_label = target_date.strftime("%a")
-            
-            start_dt = datetime.combine(target_date, datetime.min.time())
-            end_dt = datetime.combine(target_date, datetime.max.time())
-            
-            count = await get_count(
-                select(func.count(Task.task_id)).where(
-                    and_(
-                        Task.user_id == user.user_id,
-                        Task.completed == True,
-                        Task.completed_at >= start_dt,
-                        Task.completed_at <= end_dt
-                    )
-                )
-            )
-            data.append({"day": day_label, "completed": count})
+            data.append({"day": target_date.strftime("%a"), "completed": per_day.get(target_date, 0)})
         return data
 
-    current_date = datetime.utcnow().date()
-    # Find start of this week (Monday)
-    this_week_start = current_date - timedelta(days=current_date.weekday())
-    last_week_start = this_week_start - timedelta(days=7)
-
-    this_week_data = await get_week_data(this_week_start)
-    last_week_data = await get_week_data(last_week_start)
-
-    pomodoro_count = await get_count(select(func.count(PomodoroSession.session_id)).where(and_(PomodoroSession.user_id == user.user_id, PomodoroSession.completed)))
-
     return {
         "total": total,
         "completed": completed,
@@ -342,8 +583,8 @@ async def get_stats(user: User = Depends(get_current_user), db=Depends(get_sessi
         "streak": streak,
         "completion_rate": round((completed / total * 100) if total else 0, 1),
         "pomodoro_sessions": pomodoro_count,
-        "this_week_data": this_week_data,
-        "last_week_data": last_week_data
+        "this_week_data": week_data(this_week_start),
+        "last_week_data": week_data(last_week_start)
     }
 
 # Pomodoro
@@ -356,8 +597,8 @@ async def start_pomodoro(data: dict, user: User = Depends(get_current_user), db=
         duration=data.get("duration", 25)
     )
     db.add(session)
+    await bump_versions(db, user.user_id, "pomodoro")
     await db.commit()
-    await db.refresh(session)
     return session.dict()
 
 @app.post("/api/pomodoro/{session_id}/complete")
@@ -367,14 +608,111 @@ async def complete_pomodoro(session_id: str, user: User = Depends(get_current_us
     session = result.first()
     if not session:
         raise HTTPException(status_code=404)
+    if not session.completed:
+        await bump_rollup(db, user.user_id, rollup_day(session.created_at), pomodoro_count=1)
     session.completed = True
+    await bump_versions(db, user.user_id, "pomodoro")
     await db.commit()
     return {"message": "Completed"}
 
+# Delta sync
+@app.get("/api/sync")
+async def sync_changes(since: Optional[str] = None, user: User = Depends(get_current_user), db=Depends(get_session)):
+    # Taken before reading so nothing written during the reads is skipped next time
+    new_cursor = encode_sync_cursor(datetime.utcnow())
+    reset, changed, deleted = await collect_changes(db, user.user_id, decode_sync_cursor(since) if since else None)
+    # Buffered layout changes have not reached the table yet
+    notes = {n.note_id: n for n in changed["notes"]}
+    notes.update({n["note_id"]: n for n in note_buffer.pending_notes(user.user_id)})
+    return {
+        "cursor": new_cursor,
+        "reset": reset,
+        "tasks": await tasks_to_dicts(db, changed["tasks"]),
+        "notes": list(notes.values()),
+        "edges": changed["edges"],
+        "deleted": deleted,
+    }
+
+# Workspace backup: every row a user owns as NDJSON, and the matching import
+@app.get("/api/export")
+async def export_data(user: User = Depends(get_current_user)):
+    # Queued activity events are written first so the export includes them
+    await activity_log.flush(async_session)
+    filename = f"checktick-{datetime.utcnow().date().isoformat()}.ndjson"
+    return StreamingResponse(
+        export_workspace(async_session, user.user_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.post("/api/import")
+async def import_data(request: Request, user: User = Depends(get_current_user), db=Depends(get_session)):
+    # The body is read as it arrives, one batch at a time
+    return await import_workspace(db, user.user_id, request.stream())
+
+@app.get("/api/events")
+async def stream_events(request: Request, last_event_id: Optional[str] = None):
+    # Authenticates with a short-lived session rather than Depends(get_session),
+    # which would hold a pooled connection for the life of the stream
+    async with async_session() as db:
+        user = await get_current_user(request, db)
+    # Browsers send Last-Event-ID when reconnecting; the query parameter lets a new page resume
+    resume = request.headers.get("last-event-id") or last_event_id
+    try:
+        last_id = int(resume) if resume else None
+    except ValueError:
+        last_id = None
+    return StreamingResponse(
+        change_hub.stream(async_session, user.user_id, get_session_token(request), last_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/health")
 async def health():
     return {"status": "healthy"}
 
+@app.get("/api/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_metrics_token)])
+async def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/health/slow-queries", dependencies=[Depends(require_metrics_token)])
+async def slow_query_log():
+    return list(slow_queries)
+
+@app.get("/api/health/db", dependencies=[Depends(require_metrics_token)])
+async def db_health():
+    return pool_status()
+
+@app.get("/api/health/scheduler", dependencies=[Depends(require_metrics_token)])
+async def scheduler_health():
+    return scheduler.stats()
+
+@app.get("/api/health/session-cache", dependencies=[Depends(require_metrics_token)])
+async def session_cache_health():
+    return session_cache.stats()
+
+@app.get("/api/health/hash-pool", dependencies=[Depends(require_metrics_token)])
+async def hash_pool_health():
+    return hash_pool.stats()
+
+@app.get("/api/health/note-buffer", dependencies=[Depends(require_metrics_token)])
+async def note_buffer_health():
+    return note_buffer.stats()
+
+@app.get("/api/health/graph-cache", dependencies=[Depends(require_metrics_token)])
+async def graph_cache_health():
+    return graph_cache.stats()
+
+@app.get("/api/health/events", dependencies=[Depends(require_metrics_token)])
+async def events_health():
+    return change_hub.stats()
+
+@app.get("/api/health/activity-log", dependencies=[Depends(require_metrics_token)])
+async def activity_log_health():
+    return activity_log.stats()
+
 # Sticky Notes
 class StickyNoteCreate(SQLModel):
     content: str = ""
@@ -392,61 +730,112 @@ class StickyNoteUpdate(SQLModel):
     z_index: Optional[int] = None
     is_expanded: Optional[bool] = None
 
-@app.get("/api/notes")
-async def get_notes(user: User = Depends(get_current_user), db=Depends(get_session)):
-    result = await db.exec(select(StickyNote).where(StickyNote.user_id == user.user_id))
-    return result.all()
-
-@app.post("/api/notes")
-async def create_note(note_data: StickyNoteCreate, user: User = Depends(get_current_user), db=Depends(get_session)):
-    new_note = StickyNote(
-        note_id=str(uuid.uuid4()),
-        user_id=user.user_id,
-        **note_data.dict()
+    @field_validator("*")
+    @classmethod
+    def not_null(cls, value):
+        # Omit a field to leave it unchanged; every note column is NOT NULL
+        if value is None:
+            raise ValueError("must not be null")
+        return value
+
+class NoteOut(SQLModel):
+    note_id: str
+    user_id: str
+    content: str
+    color: str
+    x_position: int
+    y_position: int
+    z_index: int
+    is_expanded: bool
+    created_at: datetime
+    updated_at: datetime
+
+class EdgeOut(SQLModel):
+    edge_id: str
+    user_id: str
+    source: str
+    target: str
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+class NoteGraphOut(SQLModel):
+    notes: list[NoteOut]
+    edges: list[EdgeOut]
+    frontier: list[str]  # returned notes with unloaded neighbors
+
+@app.get("/api/notes", response_model=list[NoteOut])
+async def get_notes(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user: User = Depends(get_current_user),
+    db=Depends(get_read_session),
+):
+    not_modified = await check_not_modified(
+        request, response, db, user.user_id, "notes", extra=(note_buffer.generation(user.user_id),)
     )
-    db.add(new_note)
+    if not_modified:
+        return not_modified
+    stmt = select(StickyNote).where(StickyNote.user_id == user.user_id)
+    notes = await paginate(db, stmt, [StickyNote.created_at, StickyNote.note_id], limit, cursor, response)
+    return [note_buffer.overlay(n) for n in notes]
+
+async def note_subgraph(request: Request, response: Response, db, user_id, note_id, max_depth):
+    not_modified = await check_not_modified(
+        request, response, db, user_id, "notes", "edges", extra=(note_buffer.generation(user_id),)
+    )
+    if not_modified:
+        return not_modified
+    adjacency = await graph_cache.get(db, user_id)
+    note_ids, edge_ids, frontier = adjacency.walk(note_id, max_depth)
+    result = await db.exec(select(StickyNote).where(StickyNote.user_id == user_id, StickyNote.note_id.in_(note_ids)))
+    order = {nid: i for i, nid in enumerate(note_ids)}
+    notes = sorted(result.all(), key=lambda n: order[n.note_id])
+    if not notes or notes[0].note_id != note_id:
+        raise HTTPException(status_code=404, detail="Note not found")
+    edges = (await db.exec(select(NoteEdge).where(NoteEdge.edge_id.in_(edge_ids)))).all() if edge_ids else []
+    # frontier: returned notes with unloaded neighbors, to expand from next
+    return {"notes": [note_buffer.overlay(n) for n in notes], "edges": edges, "frontier": frontier}
+
+@app.get("/api/notes/{note_id}/neighborhood", response_model=NoteGraphOut)
+async def get_note_neighborhood(
+    request: Request,
+    response: Response,
+    note_id: str,
+    depth: int = Query(1, ge=1, le=GRAPH_MAX_DEPTH),
+    user: User = Depends(get_current_user),
+    db=Depends(get_read_session),
+):
+    return await note_subgraph(request, response, db, user.user_id, note_id, depth)
+
+@app.get("/api/notes/{note_id}/component", response_model=NoteGraphOut)
+async def get_note_component(request: Request, response: Response, note_id: str, user: User = Depends(get_current_user), db=Depends(get_read_session)):
+    # The whole connected component, up to GRAPH_MAX_NOTES
+    return await note_subgraph(request, response, db, user.user_id, note_id, None)
+
+@app.post("/api/notes", response_model=NoteOut)
+async def create_note(note_data: StickyNoteCreate, user: User = Depends(get_current_user), db=Depends(get_session)):
+    new_note = await mutations.create_note(db, user.user_id, note_data.dict())
     await db.commit()
-    await db.refresh(new_note)
     return new_note
 
-@app.put("/api/notes/{note_id}")
+@app.put("/api/notes/{note_id}", response_model=NoteOut)
 async def update_note(note_id: str, note_update: StickyNoteUpdate, user: User = Depends(get_current_user), db=Depends(get_session)):
-    result = await db.exec(select(StickyNote).where(and_(StickyNote.note_id == note_id, StickyNote.user_id == user.user_id)))
-    note = result.first()
-    if not note:
-        raise HTTPException(status_code=404, detail="Note not found")
-        
     update_data = note_update.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(note, key, value)
-        
-    note.updated_at = datetime.utcnow()
+    if note_buffer.is_layout_only(update_data):
+        # Drags arrive many times a second; coalesce them and write on the next flush
+        note = await note_buffer.stage(db, user.user_id, note_id, update_data)
+        if note is None:
+            raise HTTPException(status_code=404, detail="Note not found")
+        return note
+    note = await mutations.update_note(db, user.user_id, note_id, update_data)
     await db.commit()
-    await db.refresh(note)
     return note
 
 @app.delete("/api/notes/{note_id}")
 async def delete_note(note_id: str, user: User = Depends(get_current_user), db=Depends(get_session)):
-    result = await db.exec(select(StickyNote).where(and_(StickyNote.note_id == note_id, StickyNote.user_id == user.user_id)))
-    note = result.first()
-    if not note:
-        raise HTTPException(status_code=404, detail="Note not found")
-        
-    # Delete associated edges first to prevent FK violation
-    edges_result = await db.exec(select(NoteEdge).where((NoteEdge.source == note_id) | (NoteEdge.target == note_id)))
-    edges = edges_result.all()
-    
-    for edge in edges:
-        await db.delete(edge)
-        # Log edge deletion
-        db.add(ActivityLog(
-            user_id=user.user_id,
-            action="delete_edge_cascade",
-            task_id=edge.edge_id,
-            task_title="Cascade Delete from Note"
-        ))
-
-    await db.delete(note)
+    await mutations.delete_note(db, user.user_id, note_id)
     await db.commit()
     return {"message": "Note deleted"}
 
@@ -455,66 +844,105 @@ class EdgeCreate(SQLModel):
     source: str
     target: str
 
-@app.get("/api/edges")
-async def get_edges(user: User = Depends(get_current_user), db=Depends(get_session)):
-    result = await db.exec(select(NoteEdge).where(NoteEdge.user_id == user.user_id))
-    return result.all()
-
-@app.post("/api/edges")
+@app.get("/api/edges", response_model=list[EdgeOut])
+async def get_edges(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user: User = Depends(get_current_user),
+    db=Depends(get_read_session),
+):
+    not_modified = await check_not_modified(request, response, db, user.user_id, "edges")
+    if not_modified:
+        return not_modified
+    stmt = select(NoteEdge).where(NoteEdge.user_id == user.user_id)
+    return await paginate(db, stmt, [NoteEdge.created_at, NoteEdge.edge_id], limit, cursor, response)
+
+@app.post("/api/edges", response_model=EdgeOut)
 async def create_edge(edge_data: EdgeCreate, user: User = Depends(get_current_user), db=Depends(get_session)):
-    # IDOR Check: Ensure both notes belong to user
-    stmt = select(StickyNote).where(
-        and_(
-            StickyNote.user_id == user.user_id,
-            (StickyNote.note_id == edge_data.source) | (StickyNote.note_id == edge_data.target)
-        )
-    )
-    result = await db.exec(stmt)
-    notes = result.all()
-    found_ids = {n.note_id for n in notes}
-    
-    # Must find both source and target (if they are different, count should be 2; if same, count 1)
-    if edge_data.source not in found_ids or edge_data.target not in found_ids:
-         raise HTTPException(status_code=403, detail="Access denied to one or both notes")
-
-    new_edge = NoteEdge(
-        edge_id=str(uuid.uuid4()),
-        user_id=user.user_id,
-        source=edge_data.source,
-        target=edge_data.target
-    )
-    db.add(new_edge)
-    
-    # Audit Log
-    log = ActivityLog(
-        user_id=user.user_id,
-        action="create_edge",
-        task_id=new_edge.edge_id, # Using ID for tracking
-        task_title="Connected Notes"
-    )
-    db.add(log)
-    
+    new_edge = await mutations.create_edge(db, user.user_id, edge_data.source, edge_data.target)
     await db.commit()
-    await db.refresh(new_edge)
     return new_edge
 
 @app.delete("/api/edges/{edge_id}")
 async def delete_edge(edge_id: str, user: User = Depends(get_current_user), db=Depends(get_session)):
-    result = await db.exec(select(NoteEdge).where(and_(NoteEdge.edge_id == edge_id, NoteEdge.user_id == user.user_id)))
-    edge = result.first()
-    if not edge:
-        raise HTTPException(status_code=404, detail="Edge not found")
-    
-    await db.delete(edge)
-    
-    # Audit Log
-    log = ActivityLog(
-        user_id=user.user_id,
-        action="delete_edge",
-        task_id=edge_id,
-        task_title="Removed Connection"
-    )
-    db.add(log)
-    
+    await mutations.delete_edge(db, user.user_id, edge_id)
+    await db.commit()
+    return {"message": "Edge deleted"}
+
+# Batch mutations
+MAX_BATCH_OPERATIONS = 200
+
+class BatchOperation(BaseModel):
+    op: str  # create | update | delete
+    type: str  # task | note | edge
+    id: Optional[str] = None  # required for update/delete
+    data: dict = {}
+
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation]
+
+async def _apply_batch_operation(db, user_id: str, operation: BatchOperation):
+    kind = (operation.type, operation.op)
+    if operation.op in ("update", "delete") and not operation.id:
+        raise HTTPException(status_code=400, detail="id is required")
+    if kind == ("task", "create"):
+        return await mutations.create_task(db, user_id, operation.data)
+    if kind == ("task", "update"):
+        return await mutations.update_task(db, user_id, operation.id, operation.data)
+    if kind == ("task", "delete"):
+        return await mutations.delete_task(db, user_id, operation.id)
+    if kind == ("note", "create"):
+        return await mutations.create_note(db, user_id, StickyNoteCreate(**operation.data).dict())
+    if kind == ("note", "update"):
+        return await mutations.update_note(db, user_id, operation.id, StickyNoteUpdate(**operation.data).dict(exclude_unset=True))
+    if kind == ("note", "delete"):
+        return await mutations.delete_note(db, user_id, operation.id)
+    if kind == ("edge", "create"):
+        edge_data = EdgeCreate(**operation.data)
+        return await mutations.create_edge(db, user_id, edge_data.source, edge_data.target)
+    if kind == ("edge", "delete"):
+        return await mutations.delete_edge(db, user_id, operation.id)
+    raise HTTPException(status_code=400, detail=f"Unsupported operation {operation.op} on {operation.type}")
+
+@app.post("/api/batch")
+async def batch(data: BatchRequest, user: User = Depends(get_current_user), db=Depends(get_session)):
+    # All operations share one auth check and one transaction: all apply or none do
+    if len(data.operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+
+    outcomes = []
+    for index, operation in enumerate(data.operations):
+        try:
+            outcomes.append(await _apply_batch_operation(db, user.user_id, operation))
+            # Surface constraint errors against the operation that caused them
+            await db.flush()
+        except HTTPException as exc:
+            await db.rollback()
+            return JSONResponse(status_code=exc.status_code, content={
+                "committed": False, "failed_index": index, "detail": exc.detail,
+            })
+        except ValidationError as exc:
+            await db.rollback()
+            return JSONResponse(status_code=422, content={
+                "committed": False, "failed_index": index, "detail": json.loads(exc.json()),
+            })
+        except (IntegrityError, DataError) as exc:
+            await db.rollback()
+            return JSONResponse(status_code=409 if isinstance(exc, IntegrityError) else 422, content={
+                "committed": False, "failed_index": index, "detail": str(exc.orig),
+            })
+
+    # Results are built before the commit, so nothing is read back afterwards
+    results = []
+    subtasks = await load_subtasks(db, [o.task_id for o in outcomes if isinstance(o, Task)])
+    for outcome in outcomes:
+        if isinstance(outcome, Task):
+            results.append({"status": 200, "data": task_to_dict(outcome, subtasks[outcome.task_id])})
+        elif outcome is not None:
+            results.append({"status": 200, "data": outcome.dict()})
+        else:
+            results.append({"status": 200})
     await db.commit()
-    return {"message": "Edge deleted"}
\ No newline at end of file
+    return {"committed": True, "results": results}
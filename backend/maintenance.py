@@ -0,0 +1,68 @@
+from sqlmodel import select, delete
+from datetime import datetime, timedelta
+from collections import Counter
+from models import UserSession, ActivityLog, ActivityLogSummary
+from rollups import rollup_day
+from upserts import upsert_increment
+from session_cache import session_cache
+from sync import compact_tombstones
+from recurrence import advance_recurring_tasks, RECURRENCE_INTERVAL
+from events import prune_change_events, EVENTS_PRUNE_INTERVAL
+import os
+
+SESSION_PURGE_INTERVAL = int(os.getenv("SESSION_PURGE_INTERVAL", "3600"))
+ACTIVITY_LOG_RETENTION_DAYS = int(os.getenv("ACTIVITY_LOG_RETENTION_DAYS", "365"))
+ACTIVITY_COMPACT_INTERVAL = int(os.getenv("ACTIVITY_COMPACT_INTERVAL", "86400"))
+TOMBSTONE_COMPACT_INTERVAL = int(os.getenv("TOMBSTONE_COMPACT_INTERVAL", "3600"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "1000"))
+
+# Each job commits per batch so locks are held briefly and progress survives a restart.
+
+async def purge_expired_sessions(db, batch_size=MAINTENANCE_BATCH_SIZE):
+    """Delete expired UserSession rows; returns how many were removed."""
+    now = datetime.utcnow()
+    removed = 0
+    while True:
+        tokens = (await db.exec(
+            select(UserSession.session_token).where(UserSession.expires_at < now).limit(batch_size)
+        )).all()
+        if not tokens:
+            break
+        await db.exec(delete(UserSession).where(UserSession.session_token.in_(tokens)))
+        await db.commit()
+        for token in tokens:
+            session_cache.invalidate(token)
+        removed += len(tokens)
+    return removed
+
+async def compact_activity_log(db, retention_days=ACTIVITY_LOG_RETENTION_DAYS, batch_size=MAINTENANCE_BATCH_SIZE):
+    """Fold ActivityLog rows older than the retention window into per-day ActivityLogSummary counts."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    removed = 0
+    while True:
+        rows = (await db.exec(
+            select(ActivityLog.id, ActivityLog.user_id, ActivityLog.action, ActivityLog.created_at)
+            .where(ActivityLog.created_at < cutoff)
+            .order_by(ActivityLog.created_at)
+            .limit(batch_size)
+        )).all()
+        if not rows:
+            break
+        counts = Counter((user_id, rollup_day(created_at), action) for _, user_id, action, created_at in rows)
+        # Summary and delete commit together, so a row is never counted twice
+        for (user_id, day, action), n in counts.items():
+            await upsert_increment(
+                db, ActivityLogSummary, {"user_id": user_id, "day": day, "action": action}, {"count": n}
+            )
+        await db.exec(delete(ActivityLog).where(ActivityLog.id.in_([row[0] for row in rows])))
+        await db.commit()
+        removed += len(rows)
+    return removed
+
+
+def register_jobs(scheduler):
+    scheduler.add_job("purge_expired_sessions", SESSION_PURGE_INTERVAL, purge_expired_sessions)
+    scheduler.add_job("compact_activity_log", ACTIVITY_COMPACT_INTERVAL, compact_activity_log)
+    scheduler.add_job("compact_tombstones", TOMBSTONE_COMPACT_INTERVAL, compact_tombstones)
+    scheduler.add_job("advance_recurring_tasks", RECURRENCE_INTERVAL, advance_recurring_tasks)
+    scheduler.add_job("prune_change_events", EVENTS_PRUNE_INTERVAL, prune_change_events)
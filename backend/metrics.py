@@ -0,0 +1,198 @@
+from fastapi import HTTPException, Request
+from sqlalchemy import event
+from collections import deque
+from datetime import datetime
+from query_counter import count_queries, current_counter
+import bisect
+import hmac
+import logging
+import os
+import random
+import time
+
+logger = logging.getLogger("checktick.slow_query")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1.0"))
+SLOW_QUERY_LOG_SIZE = 200
+# /api/metrics and /api/health/* expose pool state, routes and SQL text; they
+# answer only "Authorization: Bearer <METRICS_TOKEN>", and nothing while it is unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "checktick_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+REQUEST_STATEMENTS = Histogram(
+    "checktick_http_request_db_statements", "SQL statements executed per request.", ("method", "route"),
+    buckets=STATEMENT_BUCKETS)
+REQUEST_DB_TIME = Histogram(
+    "checktick_http_request_db_seconds", "Time spent in SQL statements per request.", ("method", "route"))
+STATEMENTS = Counter(
+    "checktick_db_statements_total", "SQL statements by route and kind.", ("route", "kind"))
+STATEMENT_LATENCY = Histogram(
+    "checktick_db_statement_duration_seconds", "SQL statement latency by kind.", ("kind",))
+SLOW_QUERIES = Counter("checktick_db_slow_statements_total", "Statements slower than SLOW_QUERY_MS.", ("kind",))
+
+REGISTRY = [REQUEST_LATENCY, REQUEST_STATEMENTS, REQUEST_DB_TIME, STATEMENTS, STATEMENT_LATENCY, SLOW_QUERIES]
+
+slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+
+def statement_kind(statement):
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+
+def _bind_count(parameters, executemany):
+    if executemany:
+        return sum(len(p) for p in parameters)
+    return len(parameters) if parameters else 0
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    kind = statement_kind(statement)
+    STATEMENT_LATENCY.observe(elapsed, kind)
+    counter = current_counter()
+    if counter is not None:
+        counter.record(statement, elapsed)
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(kind)
+        if random.random() < SLOW_QUERY_SAMPLE_RATE:
+            entry = {
+                "at": datetime.utcnow().isoformat(),
+                "duration_ms": round(elapsed * 1000, 2),
+                "route": counter.route if counter is not None else None,
+                "statement": statement,
+                "bind_count": _bind_count(parameters, executemany),
+                "executemany": executemany,
+            }
+            slow_queries.append(entry)
+            # Bind values are left out; they may hold user data
+            logger.warning("Slow query %.1fms (%s binds) on %s: %s",
+                           entry["duration_ms"], entry["bind_count"], entry["route"], statement)
+
+def _commit(conn):
+    counter = current_counter()
+    if counter is not None:
+        counter.commits += 1
+        counter.commit_offsets.append(counter.count)
+
+def _handle_error(exception_context):
+    # Keep the timing stack balanced when a statement fails
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+def require_metrics_token(request: Request):
+    """Dependency for the operational endpoints."""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Set METRICS_TOKEN to enable this endpoint")
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
+
+def instrument_engine(engine):
+    """Time every statement run on engine (per request and globally) and log slow ones."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+    event.listen(sync_engine, "commit", _commit)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL statements per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with count_queries(scope) as counter:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Route template, not the raw path, to keep label cardinality bounded
+                route = getattr(scope.get("route"), "path", "unmatched")
+                method = scope["method"]
+                REQUEST_LATENCY.observe(time.perf_counter() - start, method, route, status)
+                REQUEST_STATEMENTS.observe(counter.count, method, route)
+                REQUEST_DB_TIME.observe(counter.elapsed, method, route)
+                for statement in counter.statements:
+                    STATEMENTS.inc(route, statement_kind(statement))
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,231 @@
+from sqlmodel import SQLModel, Field, select, delete, func
+from sqlalchemy import inspect, text, tuple_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from datetime import datetime
+import logging
+
+logger = logging.getLogger("checktick.migrations")
+
+
+class SchemaVersion(SQLModel, table=True):
+    version: int = Field(primary_key=True)
+    description: str
+    applied_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# Helpers shared by migration steps. Every step must be safe to re-run, since a
+# fresh database already has the current schema from create_all.
+
+def _existing_indexes(sync_conn, table_name):
+    return {ix["name"] for ix in inspect(sync_conn).get_indexes(table_name)}
+
+def _existing_columns(sync_conn, table_name):
+    return {col["name"] for col in inspect(sync_conn).get_columns(table_name)}
+
+# Unique indexes that existing data may violate until the migration that
+# creates them has cleaned it up; earlier steps leave them alone.
+_DEFERRED_INDEXES = {"ux_noteedge_source_target"}
+
+async def ensure_indexes(conn, include=()):
+    """Create every index declared on the models that the database lacks.
+
+    Indexes over columns a later migration has yet to add are skipped; that
+    migration calls this again once the column exists. Deferred indexes are
+    only created when named in include.
+    """
+    def create(sync_conn):
+        for table in SQLModel.metadata.sorted_tables:
+            existing = _existing_indexes(sync_conn, table.name)
+            columns = _existing_columns(sync_conn, table.name)
+            for index in table.indexes:
+                if index.name in _DEFERRED_INDEXES and index.name not in include:
+                    continue
+                if index.name not in existing and all(c.name in columns for c in index.columns):
+                    logger.info("Creating index %s on %s", index.name, table.name)
+                    index.create(sync_conn)
+    await conn.run_sync(create)
+
+async def drop_indexes(conn, table_name, *index_names):
+    """Drop indexes superseded by newer declarations, if present."""
+    def drop(sync_conn):
+        existing = _existing_indexes(sync_conn, table_name)
+        preparer = sync_conn.dialect.identifier_preparer
+        for name in index_names:
+            if name not in existing:
+                continue
+            logger.info("Dropping index %s on %s", name, table_name)
+            if sync_conn.dialect.name == "mysql":
+                sync_conn.exec_driver_sql(
+                    f"DROP INDEX {preparer.quote(name)} ON {preparer.quote(table_name)}"
+                )
+            else:
+                sync_conn.exec_driver_sql(f"DROP INDEX {preparer.quote(name)}")
+    await conn.run_sync(drop)
+
+async def ensure_columns(conn, model, *column_names):
+    """ALTER TABLE ... ADD COLUMN for declared columns missing from the database."""
+    table = model.__table__
+
+    def add(sync_conn):
+        existing = _existing_columns(sync_conn, table.name)
+        preparer = sync_conn.dialect.identifier_preparer
+        for name in column_names:
+            if name in existing:
+                continue
+            column = table.c[name]
+            col_type = column.type.compile(dialect=sync_conn.dialect)
+            ddl = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {col_type}"
+            if not column.nullable:
+                if column.server_default is None:
+                    raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{name} without a server default")
+                default = column.server_default.arg
+                if isinstance(default, str):
+                    default = "'" + default.replace("'", "''") + "'"
+                else:
+                    default = default.text
+                ddl += f" NOT NULL DEFAULT {default}"
+            logger.info("Adding column %s.%s", table.name, name)
+            sync_conn.exec_driver_sql(ddl)
+    await conn.run_sync(add)
+
+
+async def _backfill_daily_rollups(conn):
+    from rollups import backfill_rollups
+    async with AsyncSession(bind=conn, expire_on_commit=False) as db:
+        await backfill_rollups(db)
+
+async def _add_task_ranks(conn):
+    from models import Task
+    from ranking import apply_ranks
+    await ensure_columns(conn, Task, "rank")
+    async with AsyncSession(bind=conn, expire_on_commit=False) as db:
+        # Seed ranks from the legacy integer order, one user at a time
+        users = await db.exec(select(Task.user_id).where(Task.rank == "").distinct())
+        for user_id in users.all():
+            ids = await db.exec(
+                select(Task.task_id).where(Task.user_id == user_id)
+                .order_by(Task.order, Task.created_at, Task.task_id)
+            )
+            # Task.updated_at only arrives in migration 5
+            await apply_ranks(db, user_id, list(ids.all()), touch=False)
+    await ensure_indexes(conn)
+
+async def _keyset_indexes(conn):
+    await ensure_indexes(conn)
+    await drop_indexes(conn, "task", "ix_task_user_order")
+    await drop_indexes(conn, "stickynote", "ix_stickynote_user")
+    await drop_indexes(conn, "noteedge", "ix_noteedge_user")
+
+async def _add_updated_at(conn):
+    from models import Task, NoteEdge
+    from sqlmodel import update
+    await ensure_columns(conn, Task, "updated_at")
+    await ensure_columns(conn, NoteEdge, "updated_at")
+    await conn.execute(update(Task).where(Task.updated_at.is_(None)).values(updated_at=Task.created_at))
+    await conn.execute(update(NoteEdge).where(NoteEdge.updated_at.is_(None)).values(updated_at=NoteEdge.created_at))
+    await ensure_indexes(conn)
+
+async def _normalize_subtasks(conn):
+    from models import Task, Subtask
+    from subtasks import parse_legacy_subtasks, subtask_rows
+    # Copy the legacy JSON into Subtask rows; the old column is left in place
+    done = select(Subtask.task_id).distinct()
+    result = await conn.execute(
+        select(Task.task_id, Task.user_id, Task.subtasks)
+        .where(Task.subtasks.is_not(None), Task.subtasks != "", Task.task_id.not_in(done))
+    )
+    rows = []
+    for task_id, user_id, value in result.all():
+        rows.extend(subtask_rows(user_id, task_id, parse_legacy_subtasks(value)))
+    for start in range(0, len(rows), 1000):
+        await conn.execute(Subtask.__table__.insert(), rows[start:start + 1000])
+    await ensure_indexes(conn)
+
+async def _add_recurrence(conn):
+    from models import Task
+    from recurrence import start_series
+    await ensure_columns(conn, Task, "series_id", "series_start", "next_due")
+    async with AsyncSession(bind=conn, expire_on_commit=False) as db:
+        # Every open recurring task starts its own series
+        tasks = await db.exec(select(Task).where(Task.recurring.is_not(None), Task.completed == False))
+        for task in tasks.all():
+            await start_series(db, task)
+        await db.flush()
+    await ensure_indexes(conn)
+
+async def _unique_edges(conn):
+    from models import NoteEdge, Tombstone
+    # Keep the oldest edge of each duplicated (source, target) pair
+    dupes = select(NoteEdge.source, NoteEdge.target).group_by(NoteEdge.source, NoteEdge.target).having(func.count() > 1)
+    result = await conn.execute(
+        select(NoteEdge.edge_id, NoteEdge.user_id, NoteEdge.source, NoteEdge.target)
+        .where(tuple_(NoteEdge.source, NoteEdge.target).in_(dupes))
+        .order_by(NoteEdge.source, NoteEdge.target, NoteEdge.created_at, NoteEdge.edge_id)
+    )
+    seen = set()
+    removed = []
+    for edge_id, user_id, source, target in result.all():
+        if (source, target) in seen:
+            removed.append((edge_id, user_id))
+        seen.add((source, target))
+    for start in range(0, len(removed), 1000):
+        chunk = removed[start:start + 1000]
+        await conn.execute(delete(NoteEdge).where(NoteEdge.edge_id.in_([edge_id for edge_id, _ in chunk])))
+        await conn.execute(Tombstone.__table__.insert(), [
+            {"user_id": user_id, "collection": "edges", "entity_id": edge_id, "deleted_at": datetime.utcnow()}
+            for edge_id, user_id in chunk
+        ])
+    await ensure_indexes(conn, include={"ux_noteedge_source_target"})
+    await drop_indexes(conn, "noteedge", "ix_noteedge_source")
+
+async def _build_search_index(conn):
+    from search import rebuild_index
+    async with AsyncSession(bind=conn, expire_on_commit=False) as db:
+        await rebuild_index(db)
+
+
+# (version, description, step). Append only; never renumber or edit applied steps.
+MIGRATIONS = [
+    (1, "Composite indexes for hot query shapes", ensure_indexes),
+    (2, "Backfill DailyRollup from existing data", _backfill_daily_rollups),
+    (3, "Fractional Task.rank ordering", _add_task_ranks),
+    (4, "Keyset pagination indexes; drop superseded indexes", _keyset_indexes),
+    (5, "updated_at on Task/NoteEdge for delta sync", _add_updated_at),
+    (6, "ActivityLog.created_at index for the retention job", ensure_indexes),
+    (7, "Move Task.subtasks JSON into the Subtask table", _normalize_subtasks),
+    (8, "Task series columns for the recurrence engine", _add_recurrence),
+    (9, "Unique NoteEdge (source, target); drop duplicate edges", _unique_edges),
+    (10, "Build the SearchTerm index", _build_search_index),
+]
+
+
+async def run_migrations(engine):
+    """Apply pending MIGRATIONS in order, each in its own transaction."""
+    async with engine.begin() as conn:
+        await conn.run_sync(SchemaVersion.__table__.create, checkfirst=True)
+
+    lock_conn = None
+    if engine.dialect.name == "mysql":
+        # Several workers start at once; only one should run DDL
+        lock_conn = await engine.connect()
+        await lock_conn.execute(text("SELECT GET_LOCK('checktick_migrations', 60)"))
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(select(SchemaVersion.version))
+            applied = {row[0] for row in result}
+
+        for version, description, step in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info("Applying migration %s: %s", version, description)
+            async with engine.begin() as conn:
+                await step(conn)
+                await conn.execute(
+                    SchemaVersion.__table__.insert().values(
+                        version=version, description=description, applied_at=datetime.utcnow()
+                    )
+                )
+    finally:
+        if lock_conn is not None:
+            await lock_conn.execute(text("SELECT RELEASE_LOCK('checktick_migrations')"))
+            await lock_conn.close()
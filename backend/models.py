@@ -1,7 +1,7 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from typing import Optional
-from datetime import datetime
-import json
+from datetime import datetime, date
 
 class User(SQLModel, table=True):
     user_id: str = Field(primary_key=True)
@@ -12,6 +12,16 @@ class User(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Task(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_task_user_rank", "user_id", "rank", "task_id"),
+        Index("ix_task_user_completed_at", "user_id", "completed", "completed_at"),
+        Index("ix_task_user_due_date", "user_id", "due_date", "completed"),
+        Index("ix_task_user_updated", "user_id", "updated_at"),
+        Index("ix_task_user_next_due", "user_id", "next_due"),  # lazy recurrence per user
+        Index("ix_task_next_due", "next_due"),  # recurrence job
+        Index("ix_task_series", "series_id"),
+    )
+
     task_id: str = Field(primary_key=True)
     user_id: str = Field(foreign_key="user.user_id")
     title: str
@@ -20,13 +30,48 @@ class Task(SQLModel, table=True):
     category: str = Field(default="personal")
     due_date: Optional[str] = None  # YYYY-MM-DD string
     completed: bool = Field(default=False)
-    order: int = Field(default=0)
-    recurring: Optional[str] = None
+    order: int = Field(default=0)  # legacy position; lists are sorted by rank
+    rank: str = Field(default="", max_length=64, sa_column_kwargs={"server_default": ""})  # see ranking.py
+    recurring: Optional[str] = None  # see recurrence.py
+    series_id: Optional[str] = None  # task_id that started the series
+    series_start: Optional[str] = None  # YYYY-MM-DD, anchors monthly rules
+    next_due: Optional[str] = None  # set on the series head only: next occurrence to create
     created_at: datetime = Field(default_factory=datetime.utcnow)
     completed_at: Optional[datetime] = None
-    subtasks: str = Field(default="[]")  # JSON string
+    updated_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+    subtasks: str = Field(default="[]")  # legacy JSON copy, no longer read; see Subtask
+
+class Subtask(SQLModel, table=True):
+    # Checklist items of a task, one row each (previously a JSON array on Task)
+    __table_args__ = (
+        Index("ix_subtask_task_position", "task_id", "position"),
+    )
+
+    task_id: str = Field(foreign_key="task.task_id", primary_key=True)
+    subtask_id: str = Field(primary_key=True, max_length=64)  # client-chosen id, unique within the task
+    user_id: str
+    title: str
+    completed: bool = Field(default=False)
+    position: int = Field(default=0)
+
+class SearchTerm(SQLModel, table=True):
+    # Inverted index for /api/search: one row per (term, item); see search.py
+    __table_args__ = (
+        Index("ix_searchterm_entity", "kind", "entity_id"),
+    )
+
+    user_id: str = Field(primary_key=True)
+    term: str = Field(primary_key=True, max_length=64)
+    kind: str = Field(primary_key=True, max_length=8)  # task, note
+    entity_id: str = Field(primary_key=True)
+    weight: float = Field(default=1.0)
 
 class ActivityLog(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_activitylog_user_action_created", "user_id", "action", "created_at"),
+        Index("ix_activitylog_created", "created_at"),  # retention job
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: str
     action: str
@@ -35,6 +80,10 @@ class ActivityLog(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class PomodoroSession(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_pomodorosession_user_completed", "user_id", "completed"),
+    )
+
     session_id: str = Field(primary_key=True)
     user_id: str
     task_id: Optional[str] = None
@@ -43,12 +92,22 @@ class PomodoroSession(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class UserSession(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_usersession_user", "user_id"),
+        Index("ix_usersession_expires_at", "expires_at"),
+    )
+
     session_token: str = Field(primary_key=True)
     user_id: str
     expires_at: datetime
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class StickyNote(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_stickynote_user_created", "user_id", "created_at", "note_id"),
+        Index("ix_stickynote_user_updated", "user_id", "updated_at"),
+    )
+
     note_id: str = Field(primary_key=True)
     user_id: str = Field(foreign_key="user.user_id")
     content: str = Field(default="")
@@ -61,8 +120,74 @@ class StickyNote(SQLModel, table=True):
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class NoteEdge(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_noteedge_user_created", "user_id", "created_at", "edge_id"),
+        Index("ux_noteedge_source_target", "source", "target", unique=True),  # no duplicate edges
+        Index("ix_noteedge_target", "target"),
+        Index("ix_noteedge_user_updated", "user_id", "updated_at"),
+    )
+
     edge_id: str = Field(primary_key=True)
     user_id: str = Field(foreign_key="user.user_id")
     source: str = Field(foreign_key="stickynote.note_id")
     target: str = Field(foreign_key="stickynote.note_id")
-    created_at: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+
+class DailyRollup(SQLModel, table=True):
+    # Per-user, per-day counters maintained alongside Task/PomodoroSession writes
+    user_id: str = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    completed_count: int = Field(default=0)  # tasks currently completed with completed_at on this day
+    completion_events: int = Field(default=0)  # "completed" activity entries logged on this day
+    pomodoro_count: int = Field(default=0)
+
+class CollectionVersion(SQLModel, table=True):
+    # Bumped in the same transaction as every write to a user's collection; drives ETags
+    user_id: str = Field(primary_key=True)
+    collection: str = Field(primary_key=True)  # tasks, notes, edges, pomodoro
+    version: int = Field(default=0)
+
+
+class Tombstone(SQLModel, table=True):
+    # Records deletions so /api/sync can report them; compacted after a retention window
+    __table_args__ = (
+        Index("ix_tombstone_user_deleted", "user_id", "deleted_at"),
+        Index("ix_tombstone_deleted", "deleted_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: str
+    collection: str  # tasks, notes, edges
+    entity_id: str
+    deleted_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ChangeEvent(SQLModel, table=True):
+    # Change notifications for the "database" events backend (events.py); pruned after a retention window
+    __table_args__ = (
+        Index("ix_changeevent_user_id", "user_id", "id"),
+        Index("ix_changeevent_created", "created_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: str
+    collections: str  # comma-separated, e.g. "notes,edges"
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ActivityLogSummary(SQLModel, table=True):
+    # Per-day counts of ActivityLog rows removed by the retention job (maintenance.py)
+    user_id: str = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    action: str = Field(primary_key=True)
+    count: int = Field(default=0)
+
+
+class SchedulerLease(SQLModel, table=True):
+    # One row per periodic job; whoever holds an unexpired lease runs it (scheduler.py)
+    job: str = Field(primary_key=True)
+    owner: str
+    lease_until: datetime
+    last_started_at: Optional[datetime] = None
+    last_finished_at: Optional[datetime] = None
+    last_status: Optional[str] = None
+    last_result: Optional[int] = None
@@ -0,0 +1,267 @@
+from fastapi import HTTPException
+from sqlmodel import select, or_, update, delete, case, func
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+from models import Task, Subtask, StickyNote, NoteEdge
+from rollups import bump_rollup, bump_rollups, completion_day, completion_changes, rollup_day
+from ranking import append_rank
+from versions import bump_versions
+from sync import record_tombstones
+from note_buffer import note_buffer
+from activity_log import record_activity
+from upserts import update_returning
+from subtasks import insert_subtasks, replace_subtasks
+from recurrence import parse_rule, start_series, materialize
+from search import index_task, reindex_task, index_note, unindex
+import uuid
+
+SERIES_FIELDS = ("series_id", "series_start", "next_due")  # maintained by recurrence.py
+
+# Write operations shared by the single-item endpoints and /api/batch. They
+# stage every side effect (activity log, rollups, versions, tombstones) on the
+# session and leave the commit to the caller.
+
+def _check_rule(value):
+    try:
+        parse_rule(value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def create_task(db, user_id, task_data: dict):
+    # New tasks go to the end of the list; append_rank needs no lookup
+    new_task = Task(
+        task_id=f"task_{uuid.uuid4().hex[:12]}",
+        user_id=user_id,
+        rank=append_rank(),
+        **{k: v for k, v in task_data.items() if k not in ("subtasks", "rank", "order", *SERIES_FIELDS)}
+    )
+    if new_task.recurring:
+        _check_rule(new_task.recurring)
+        await start_series(db, new_task)
+    db.add(new_task)
+    if task_data.get("subtasks"):
+        # Parent row first; subtasks reference it
+        await db.flush()
+        await insert_subtasks(db, user_id, new_task.task_id, task_data["subtasks"])
+    titles = [s.get("title", "") for s in task_data.get("subtasks") or [] if isinstance(s, dict)]
+    await index_task(db, new_task, titles, new=True)
+    record_activity(db, user_id, "created", new_task.task_id, new_task.title)
+    await bump_rollup(db, user_id, completion_day(new_task), completed_count=1)
+    await bump_versions(db, user_id, "tasks")
+    return new_task
+
+async def update_task(db, user_id, task_id, task_data: dict):
+    stmt = select(Task).where(Task.task_id == task_id, Task.user_id == user_id)
+    result = await db.exec(stmt)
+    task = result.first()
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    # Capture previous state
+    was_not_completed = not task.completed
+    before_day = completion_day(task)
+    before_series = (task.recurring, task.due_date)
+    before_text = (task.title, task.description)
+    if task_data.get("recurring"):
+        _check_rule(task_data["recurring"])
+
+    for key, value in task_data.items():
+        if key in SERIES_FIELDS:
+            continue
+        if key == "subtasks":
+            # A full list from the client replaces the task's subtasks
+            await replace_subtasks(db, user_id, task_id, value)
+        else:
+            setattr(task, key, value)
+
+    if (task.title, task.description) != before_text or "subtasks" in task_data:
+        await reindex_task(db, user_id, task_id)
+
+    # The full-task PUT resends unchanged fields; only real changes restart a series
+    if task.recurring != before_series[0] or (task.next_due and task.due_date != before_series[1]):
+        await start_series(db, task)
+
+    # Check if newly completed
+    if task_data.get("completed") and was_not_completed:
+        task.completed_at = datetime.utcnow()
+        logged_at = record_activity(db, user_id, "completed", task_id, task.title)
+        if task.next_due:
+            await materialize(db, [task])
+    else:
+        logged_at = None
+
+    task.updated_at = datetime.utcnow()
+    # Completing today touches one rollup row twice; merge into a single upsert
+    changes = completion_changes(before_day, completion_day(task))
+    if logged_at is not None:
+        changes.setdefault(rollup_day(logged_at), {})["completion_events"] = 1
+    await bump_rollups(db, user_id, changes)
+    await bump_versions(db, user_id, "tasks")
+    return task
+
+async def delete_task(db, user_id, task_id):
+    stmt = select(Task).where(Task.task_id == task_id, Task.user_id == user_id)
+    result = await db.exec(stmt)
+    task = result.first()
+    if not task:
+        raise HTTPException(status_code=404)
+
+    await bump_rollup(db, user_id, completion_day(task), completed_count=-1)
+    await bump_versions(db, user_id, "tasks")
+    record_tombstones(db, user_id, "tasks", [task_id])
+    await db.exec(delete(Subtask).where(Subtask.task_id == task_id))
+    await unindex(db, "task", [task_id])
+    await db.delete(task)
+
+
+async def _touch_task(db, user_id, task_id):
+    # Subtask writes leave the task row alone apart from updated_at, which delta sync keys on
+    result = await db.exec(
+        update(Task).where(Task.task_id == task_id, Task.user_id == user_id).values(updated_at=datetime.utcnow())
+    )
+    if not result.rowcount:
+        raise HTTPException(status_code=404, detail="Task not found")
+    await bump_versions(db, user_id, "tasks")
+
+async def create_subtask(db, user_id, task_id, subtask_data: dict):
+    await _touch_task(db, user_id, task_id)
+    subtask_id = subtask_data.get("id") or uuid.uuid4().hex[:12]
+    # Next position and an id clash check in one query
+    result = await db.exec(
+        select(func.max(Subtask.position), func.sum(case((Subtask.subtask_id == subtask_id, 1), else_=0)))
+        .where(Subtask.task_id == task_id)
+    )
+    last_position, clashes = result.one()
+    if clashes:
+        raise HTTPException(status_code=409, detail="Subtask id already exists")
+    subtask = Subtask(
+        task_id=task_id,
+        subtask_id=subtask_id,
+        user_id=user_id,
+        title=subtask_data["title"],
+        completed=subtask_data.get("completed", False),
+        position=-1 if last_position is None else last_position + 1,
+    )
+    db.add(subtask)
+    await reindex_task(db, user_id, task_id)
+    return subtask
+
+async def update_subtask(db, user_id, task_id, subtask_id, update_data: dict):
+    where = [Subtask.task_id == task_id, Subtask.subtask_id == subtask_id, Subtask.user_id == user_id]
+    if update_data:
+        subtask = await update_returning(db, Subtask, where, update_data)
+    else:
+        subtask = (await db.exec(select(Subtask).where(*where))).first()
+    if not subtask:
+        raise HTTPException(status_code=404, detail="Subtask not found")
+    await _touch_task(db, user_id, task_id)
+    if "title" in update_data:
+        await reindex_task(db, user_id, task_id)
+    return subtask
+
+async def delete_subtask(db, user_id, task_id, subtask_id):
+    result = await db.exec(delete(Subtask).where(
+        Subtask.task_id == task_id, Subtask.subtask_id == subtask_id, Subtask.user_id == user_id))
+    if not result.rowcount:
+        raise HTTPException(status_code=404, detail="Subtask not found")
+    await _touch_task(db, user_id, task_id)
+    await reindex_task(db, user_id, task_id)
+
+async def reorder_subtasks(db, user_id, task_id, subtask_ids):
+    await _touch_task(db, user_id, task_id)
+    subtask_ids = list(dict.fromkeys(subtask_ids))
+    if not subtask_ids:
+        return
+    # One UPDATE; ids left out keep their position
+    await db.exec(
+        update(Subtask)
+        .where(Subtask.task_id == task_id, Subtask.user_id == user_id, Subtask.subtask_id.in_(subtask_ids))
+        .values(position=case({sid: i for i, sid in enumerate(subtask_ids)}, value=Subtask.subtask_id))
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def create_note(db, user_id, note_data: dict):
+    new_note = StickyNote(
+        note_id=str(uuid.uuid4()),
+        user_id=user_id,
+        **note_data
+    )
+    db.add(new_note)
+    await index_note(db, new_note, new=True)
+    await bump_versions(db, user_id, "notes")
+    return new_note
+
+async def update_note(db, user_id, note_id, update_data: dict):
+    # A synchronous write supersedes any buffered layout; fold it in so it is not lost
+    buffered = note_buffer.take(note_id, user_id)
+    values = {**buffered, **update_data, "updated_at": datetime.utcnow()}
+    note = await update_returning(
+        db, StickyNote, [StickyNote.note_id == note_id, StickyNote.user_id == user_id], values
+    )
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    if "content" in update_data:
+        await index_note(db, note)
+    await bump_versions(db, user_id, "notes")
+    return note
+
+async def delete_note(db, user_id, note_id):
+    # Set-based cascade: one read of the edge ids (for tombstones), one DELETE each
+    edge_ids = (await db.exec(
+        select(NoteEdge.edge_id).where(NoteEdge.user_id == user_id, or_(NoteEdge.source == note_id, NoteEdge.target == note_id))
+    )).all()
+    if edge_ids:
+        await db.exec(delete(NoteEdge).where(NoteEdge.edge_id.in_(edge_ids)))
+    result = await db.exec(delete(StickyNote).where(StickyNote.note_id == note_id, StickyNote.user_id == user_id))
+    if not result.rowcount:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    if edge_ids:
+        # One audit entry for the whole cascade
+        record_activity(db, user_id, "delete_edge_cascade", note_id, f"Cascade Delete from Note ({len(edge_ids)} edges)")
+    record_tombstones(db, user_id, "edges", edge_ids)
+    record_tombstones(db, user_id, "notes", [note_id])
+    await unindex(db, "note", [note_id])
+    note_buffer.take(note_id, user_id)
+    await bump_versions(db, user_id, "notes", "edges")
+
+
+async def create_edge(db, user_id, source, target):
+    # IDOR check: both notes must belong to the user (one row when source == target)
+    owned = (await db.exec(
+        select(func.count()).select_from(StickyNote)
+        .where(StickyNote.user_id == user_id, StickyNote.note_id.in_({source, target}))
+    )).one()
+    if owned != len({source, target}):
+        raise HTTPException(status_code=403, detail="Access denied to one or both notes")
+
+    new_edge = NoteEdge(
+        edge_id=str(uuid.uuid4()),
+        user_id=user_id,
+        source=source,
+        target=target
+    )
+    db.add(new_edge)
+    try:
+        # The unique (source, target) index rejects duplicates; no separate lookup
+        await db.flush()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Edge already exists")
+
+    # Audit Log
+    record_activity(db, user_id, "create_edge", new_edge.edge_id, "Connected Notes")  # Using ID for tracking
+    await bump_versions(db, user_id, "edges")
+    return new_edge
+
+async def delete_edge(db, user_id, edge_id):
+    result = await db.exec(delete(NoteEdge).where(NoteEdge.edge_id == edge_id, NoteEdge.user_id == user_id))
+    if not result.rowcount:
+        raise HTTPException(status_code=404, detail="Edge not found")
+
+    record_tombstones(db, user_id, "edges", [edge_id])
+
+    # Audit Log
+    record_activity(db, user_id, "delete_edge", edge_id, "Removed Connection")
+    await bump_versions(db, user_id, "edges")
@@ -0,0 +1,229 @@
+from sqlmodel import select, update, case, and_, tuple_
+from sqlalchemy.exc import IntegrityError, DataError
+from datetime import datetime
+from models import StickyNote
+from versions import bump_versions
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger("checktick.note_buffer")
+
+# Fields a canvas drag touches. Updates limited to these are buffered; any
+# other edit (content, colour, ...) is written synchronously as before.
+LAYOUT_FIELDS = frozenset({"x_position", "y_position", "z_index"})
+_LAYOUT_ORDER = sorted(LAYOUT_FIELDS)
+NOTE_FLUSH_INTERVAL = float(os.getenv("NOTE_FLUSH_INTERVAL", "1.0"))
+NOTE_FLUSH_CHUNK = 500
+
+
+class NoteLayoutBuffer:
+    """Write-behind buffer holding the latest layout per note.
+
+    Buffered positions are lost if the process dies before the next flush
+    (at most NOTE_FLUSH_INTERVAL seconds of drags), and other workers see
+    them only once flushed. Each entry remembers the layout it was based on
+    and is only written while the row still has it, so a layout written by
+    anything else in the meantime (a synchronous update, another worker)
+    is never overwritten by an older drag.
+    """
+
+    def __init__(self, interval: float = NOTE_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending = {}  # note_id -> {"user_id", "fields", "note", "since"}
+        self._generations = {}  # user_id -> count of buffered updates, part of the notes ETag
+        self._lock = asyncio.Lock()
+        self._task = None
+        self.updates_received = 0
+        self.rows_written = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self._flushed = {}  # note_id -> layout committed by the last flush
+        self.rows_superseded = 0
+        self.rows_dropped = 0
+        self.last_flush_lag = 0.0
+        self.max_flush_lag = 0.0
+
+    def is_layout_only(self, update_data: dict) -> bool:
+        return bool(update_data) and set(update_data) <= LAYOUT_FIELDS
+
+    async def stage(self, db, user_id: str, note_id: str, fields: dict):
+        """Buffer a layout change; returns the note as it will look once flushed, or None if not found."""
+        entry = self._pending.get(note_id)
+        if entry is None or entry["user_id"] != user_id:
+            # First buffered change for this note: check ownership and keep its row for reads
+            result = await db.exec(select(StickyNote).where(and_(StickyNote.note_id == note_id, StickyNote.user_id == user_id)))
+            note = result.first()
+            if not note:
+                return None
+            data = note.dict()
+            entry = self._pending.setdefault(note_id, {
+                "user_id": user_id, "fields": {}, "note": data, "since": time.monotonic(),
+                "base": tuple(data[f] for f in _LAYOUT_ORDER),
+            })
+        entry["fields"].update(fields)
+        entry["note"].update(fields)
+        entry["note"]["updated_at"] = datetime.utcnow()
+        self.updates_received += 1
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        return dict(entry["note"])
+
+    def take(self, note_id: str, user_id: str):
+        """Remove and return a note's buffered fields (for synchronous writes and deletes)."""
+        entry = self._pending.get(note_id)
+        if entry is None or entry["user_id"] != user_id:
+            return {}
+        del self._pending[note_id]
+        return entry["fields"]
+
+    def generation(self, user_id: str) -> int:
+        return self._generations.get(user_id, 0)
+
+    def overlay(self, note):
+        # Reads see buffered positions; works on model instances and dicts
+        entry = self._pending.get(note["note_id"] if isinstance(note, dict) else note.note_id)
+        if entry is None:
+            return note
+        data = dict(note) if isinstance(note, dict) else note.dict()
+        data.update(entry["fields"])
+        data["updated_at"] = entry["note"]["updated_at"]
+        return data
+
+    def pending_notes(self, user_id: str):
+        return [dict(e["note"]) for e in self._pending.values() if e["user_id"] == user_id]
+
+    async def _write(self, session_factory, items):
+        """Write items whose row still has their base layout; returns {note_id: layout} as committed."""
+        layouts = {}
+        async with session_factory() as db:
+            now = datetime.utcnow()
+            for start in range(0, len(items), NOTE_FLUSH_CHUNK):
+                chunk = items[start:start + NOTE_FLUSH_CHUNK]
+                values = {"updated_at": now}
+                for field in LAYOUT_FIELDS:
+                    mapping = {nid: e["fields"][field] for nid, e in chunk if field in e["fields"]}
+                    if mapping:
+                        values[field] = case(mapping, value=StickyNote.note_id, else_=getattr(StickyNote, field))
+                layout_columns = [getattr(StickyNote, f) for f in _LAYOUT_ORDER]
+                await db.exec(
+                    update(StickyNote)
+                    .where(tuple_(StickyNote.note_id, *layout_columns).in_([(nid, *e["base"]) for nid, e in chunk]))
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+                result = await db.exec(
+                    select(StickyNote.note_id, *layout_columns).where(StickyNote.note_id.in_([nid for nid, _ in chunk]))
+                )
+                layouts.update((row[0], tuple(row[1:])) for row in result.all())
+            for user_id in {e["user_id"] for _, e in items}:
+                await bump_versions(db, user_id, "notes")
+            await db.commit()
+        return layouts
+
+    async def flush(self, session_factory):
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            flushed_users = {e["user_id"] for e in batch.values()}
+            layouts = {}
+            try:
+                try:
+                    layouts = await self._write(session_factory, list(batch.items()))
+                except (IntegrityError, DataError):
+                    # A row the database rejects would fail every retry of the
+                    # batch; write rows one at a time and drop the ones that fail
+                    self.flush_errors += 1
+                    for note_id, entry in list(batch.items()):
+                        try:
+                            layouts.update(await self._write(session_factory, [(note_id, entry)]))
+                        except (IntegrityError, DataError) as e:
+                            logger.error("Dropped buffered layout %s for note %s: %s", entry["fields"], note_id, e.orig)
+                            del batch[note_id]
+                            self.rows_dropped += 1
+            except Exception:
+                self.flush_errors += 1
+                # Put the batch back without clobbering anything staged meanwhile
+                for note_id, entry in batch.items():
+                    newer = self._pending.get(note_id)
+                    if newer is None:
+                        self._pending[note_id] = entry
+                    else:
+                        newer["fields"] = {**entry["fields"], **newer["fields"]}
+                        newer["since"] = min(newer["since"], entry["since"])
+                raise
+
+            flushed = {}
+            for note_id, entry in batch.items():
+                layout = layouts.get(note_id)
+                if layout is None:
+                    continue  # deleted
+                newer = self._pending.get(note_id)
+                if layout != tuple(entry["note"][f] for f in _LAYOUT_ORDER):
+                    if layout != self._flushed.get(note_id):
+                        # Written by someone else since the entry was staged; theirs stands
+                        self.rows_superseded += 1
+                    elif newer is None:
+                        # Only our own last flush moved the row: the entry was staged
+                        # from a read that predates it, so retry on top of it
+                        self._pending[note_id] = {**entry, "base": layout}
+                        continue
+                    else:
+                        newer["fields"] = {**entry["fields"], **newer["fields"]}
+                        newer["since"] = min(newer["since"], entry["since"])
+                else:
+                    flushed[note_id] = layout
+                if newer is not None:
+                    # Staged during this flush: based on the row as it is now
+                    newer["base"] = layout
+            self._flushed = flushed
+
+            if batch:
+                lag = time.monotonic() - min(e["since"] for e in batch.values())
+                self.last_flush_lag = lag
+                self.max_flush_lag = max(self.max_flush_lag, lag)
+            self.rows_written += len(batch)
+            self.flushes += 1
+            for user_id in flushed_users:
+                if not any(e["user_id"] == user_id for e in self._pending.values()):
+                    self._generations.pop(user_id, None)
+            return len(batch)
+
+    async def _run(self, session_factory):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush(session_factory)
+            except Exception:
+                logger.exception("Note layout flush failed")
+
+    def start(self, session_factory):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(session_factory))
+
+    async def stop(self, session_factory):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush(session_factory)
+
+    def stats(self):
+        oldest = min((e["since"] for e in self._pending.values()), default=None)
+        return {
+            "pending_notes": len(self._pending),
+            "updates_received": self.updates_received,
+            "rows_written": self.rows_written,
+            "coalescing_ratio": round(self.updates_received / self.rows_written, 2) if self.rows_written else 0.0,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "rows_dropped": self.rows_dropped,
+            "rows_superseded": self.rows_superseded,
+            "current_lag_seconds": round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+            "last_flush_lag_seconds": round(self.last_flush_lag, 3),
+            "max_flush_lag_seconds": round(self.max_flush_lag, 3),
+            "flush_interval_seconds": self.interval,
+        }
+
+
+note_buffer = NoteLayoutBuffer()
@@ -0,0 +1,57 @@
+from fastapi import HTTPException
+from sqlmodel import and_, or_
+from sqlalchemy import DateTime
+from datetime import datetime
+import base64
+import json
+
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Keyset pagination: a cursor is the ordering key of the last row returned,
+# so each page is an index range scan rather than an OFFSET.
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, columns):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [
+            datetime.fromisoformat(v) if isinstance(col.type, DateTime) and v is not None else v
+            for col, v in zip(columns, values)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_key(columns, values):
+    # (c1, c2, ...) > (v1, v2, ...) spelled out so every dialect can use the index
+    col, value = columns[0], values[0]
+    if len(columns) == 1:
+        return col > value
+    return or_(col > value, and_(col == value, after_key(columns[1:], values[1:])))
+
+async def paginate(db, stmt, columns, limit=None, cursor=None, response=None):
+    """Run stmt ordered by columns, one page at a time.
+
+    Without a limit every row is returned (the original behaviour). With one,
+    the cursor for the following page is set on the X-Next-Cursor header.
+    """
+    stmt = stmt.order_by(*columns)
+    if cursor:
+        stmt = stmt.where(after_key(columns, decode_cursor(cursor, columns)))
+    if limit:
+        stmt = stmt.limit(limit + 1)
+    rows = (await db.exec(stmt)).all()
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        if response is not None:
+            last = rows[-1]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+                [last._mapping[col.key] if hasattr(last, "_mapping") else getattr(last, col.key) for col in columns]
+            )
+    return rows
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+
+# Set QUERY_COUNT_HEADER=1 to report the statements each request ran in an
+# X-Query-Count response header (handy when checking a handler's round trips).
+# Statements are recorded by the engine hooks in metrics.instrument_engine.
+QUERY_COUNT_HEADER = os.getenv("QUERY_COUNT_HEADER", "0") == "1"
+QUERY_COUNT_HEADER_NAME = "X-Query-Count"
+
+_current = ContextVar("query_counter", default=None)
+
+
+class QueryCount:
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.statements = []
+        self.elapsed = 0.0
+        self.commits = 0
+        self.commit_offsets = []  # statement count at each commit
+
+    def record(self, statement, elapsed):
+        self.statements.append(statement)
+        self.elapsed += elapsed
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def route(self):
+        if self.scope is None:
+            return None
+        # Route template once routing has matched, the raw path before that
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or self.scope.get("path")
+
+
+def current_counter():
+    return _current.get()
+
+@contextmanager
+def count_queries(scope=None):
+    """Collect the statements (and commits) run in this context.
+
+    Nested use shares the outer counter, so the metrics and X-Query-Count
+    middlewares see the same numbers for a request.
+    """
+    existing = _current.get()
+    if existing is not None:
+        yield existing
+        return
+    counter = QueryCount(scope)
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
+
+
+class QueryCountMiddleware:
+    """ASGI middleware adding X-Query-Count (statements, then commits) to every response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with count_queries(scope) as counter:
+            async def send_with_count(message):
+                if message["type"] == "http.response.start":
+                    # Statements still pending (dependency teardown) are not included
+                    headers = list(message.get("headers", []))
+                    value = f"{counter.count}; commits={counter.commits}"
+                    headers.append((QUERY_COUNT_HEADER_NAME.lower().encode(), value.encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_count)
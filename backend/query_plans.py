@@ -0,0 +1,133 @@
+from sqlmodel import select, func, and_, or_, delete
+from datetime import datetime, timedelta
+from models import Task, ActivityLog, PomodoroSession, UserSession, StickyNote, NoteEdge, DailyRollup, Tombstone, Subtask, SearchTerm, ChangeEvent
+from search import search_statement
+import asyncio
+import sys
+
+# Representative shapes of the queries issued by the API handlers. Each must be
+# answerable through an index; `python query_plans.py` fails if any is not.
+def hot_queries(dialect_name="sqlite"):
+    user_id = "user_explain"
+    now = datetime.utcnow()
+    return [
+        ("tasks by user ordered",
+         select(Task).where(Task.user_id == user_id).order_by(Task.rank, Task.task_id)),
+        ("task page after cursor",
+         select(Task).where(Task.user_id == user_id, or_(
+             Task.rank > "0k", and_(Task.rank == "0k", Task.task_id > "task_explain")))
+         .order_by(Task.rank, Task.task_id).limit(50)),
+        ("task by id and user",
+         select(Task).where(Task.task_id == "task_explain", Task.user_id == user_id)),
+        ("task totals for stats",
+         select(func.count(Task.task_id)).where(Task.user_id == user_id)),
+        ("tasks due today",
+         select(func.count(Task.task_id)).where(and_(Task.user_id == user_id, Task.due_date == now.date().isoformat()))),
+        ("tasks completed in range",
+         select(func.count(Task.task_id)).where(and_(
+             Task.user_id == user_id, Task.completed == True,
+             Task.completed_at >= now - timedelta(days=14), Task.completed_at < now))),
+        ("completion activity in range",
+         select(ActivityLog.created_at).where(and_(
+             ActivityLog.user_id == user_id, ActivityLog.action == "completed",
+             ActivityLog.created_at >= now - timedelta(days=366)))),
+        ("completed pomodoros",
+         select(func.count(PomodoroSession.session_id)).where(and_(
+             PomodoroSession.user_id == user_id, PomodoroSession.completed))),
+        ("daily rollup window",
+         select(DailyRollup).where(and_(DailyRollup.user_id == user_id, DailyRollup.day >= now.date()))),
+        ("session by token",
+         select(UserSession).where(UserSession.session_token == "st_explain")),
+        ("sessions by user",
+         delete(UserSession).where(UserSession.user_id == user_id)),
+        ("expired sessions",
+         select(UserSession.session_token).where(UserSession.expires_at < now)),
+        ("notes by user",
+         select(StickyNote).where(StickyNote.user_id == user_id).order_by(StickyNote.created_at, StickyNote.note_id)),
+        ("edges by user",
+         select(NoteEdge).where(NoteEdge.user_id == user_id).order_by(NoteEdge.created_at, NoteEdge.edge_id)),
+        ("tasks changed since",
+         select(Task).where(Task.user_id == user_id, Task.updated_at > now - timedelta(minutes=5))),
+        ("tombstones since",
+         select(Tombstone.collection, Tombstone.entity_id).where(
+             Tombstone.user_id == user_id, Tombstone.deleted_at > now - timedelta(minutes=5))),
+        ("edges touching note",
+         select(NoteEdge).where(or_(NoteEdge.source == "note_explain", NoteEdge.target == "note_explain"))),
+        ("activity log retention batch",
+         select(ActivityLog.id).where(ActivityLog.created_at < now - timedelta(days=365))
+         .order_by(ActivityLog.created_at).limit(1000)),
+        ("recurring series heads due for a user",
+         select(Task).where(Task.user_id == user_id, Task.next_due <= now.date().isoformat())),
+        ("recurring series heads due (job batch)",
+         select(Task).where(Task.next_due <= now.date().isoformat()).order_by(Task.next_due).limit(500)),
+        ("search by term prefixes",
+         search_statement(dialect_name, user_id, "plan explain x")),
+        ("search index rows of an item",
+         select(SearchTerm.term).where(SearchTerm.kind == "task", SearchTerm.entity_id == "task_explain")),
+        ("subtasks of a task",
+         select(Subtask.task_id, Subtask.subtask_id, Subtask.title, Subtask.completed)
+         .where(Subtask.task_id == "task_explain")
+         .order_by(Subtask.task_id, Subtask.position, Subtask.subtask_id)),
+        ("subtasks of a user (export)",
+         select(Subtask.task_id, Subtask.subtask_id).join(Task, Task.task_id == Subtask.task_id)
+         .where(Task.user_id == user_id).order_by(Subtask.task_id, Subtask.position)),
+        ("change events to replay for a user",
+         select(ChangeEvent.id, ChangeEvent.collections)
+         .where(ChangeEvent.user_id == user_id, ChangeEvent.id > 1000).order_by(ChangeEvent.id).limit(501)),
+        ("change events retention batch",
+         select(ChangeEvent.id).where(ChangeEvent.created_at < now - timedelta(minutes=60))
+         .order_by(ChangeEvent.created_at).limit(1000)),
+    ]
+
+
+def _explain_sql(sync_conn, stmt):
+    dialect = sync_conn.dialect
+    compiled = stmt.compile(dialect=dialect, compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    prefix = "EXPLAIN QUERY PLAN " if dialect.name == "sqlite" else "EXPLAIN "
+    return sync_conn.exec_driver_sql(prefix + compiled.string, params)
+
+def _full_scans(sync_conn, stmt):
+    """Return the plan lines that read a whole table (or a whole index)."""
+    result = _explain_sql(sync_conn, stmt)
+    rows = [dict(row._mapping) for row in result]
+    name = sync_conn.dialect.name
+    if name == "sqlite":
+        return [r["detail"] for r in rows
+                if r["detail"].startswith("SCAN ") and not r["detail"].startswith("SCAN CONSTANT")]
+    if name == "mysql":
+        return [f"{r.get('table')}: type={r.get('type')}" for r in rows if r.get("type") in ("ALL", "index")]
+    if name == "postgresql":
+        return [r["QUERY PLAN"] for r in rows if "Seq Scan" in r["QUERY PLAN"]]
+    return []
+
+async def check_query_plans(engine):
+    """EXPLAIN every hot query; returns {name: [offending plan lines]} for full scans."""
+    failures = {}
+
+    def run(sync_conn):
+        for name, stmt in hot_queries(sync_conn.dialect.name):
+            scans = _full_scans(sync_conn, stmt)
+            if scans:
+                failures[name] = scans
+
+    async with engine.connect() as conn:
+        await conn.run_sync(run)
+    return failures
+
+
+async def _main():
+    from database import engine, init_db
+    await init_db()
+    failures = await check_query_plans(engine)
+    await engine.dispose()
+    for name, scans in failures.items():
+        print(f"FULL SCAN  {name}: {'; '.join(scans)}")
+    if failures:
+        sys.exit(1)
+    print(f"All {len(hot_queries())} hot queries use an index")
+
+if __name__ == "__main__":
+    asyncio.run(_main())
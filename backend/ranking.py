@@ -0,0 +1,108 @@
+from sqlmodel import select, update, case
+from datetime import datetime, timezone
+from typing import Optional
+from models import Task
+from versions import bump_versions
+import random
+
+# Task ordering uses lexicographic fractional ranks: a task moved between two
+# neighbours gets a key that sorts between theirs, so only that row is written.
+#
+# Ranks are read as base-36 fractions ("0.k1k2k3..."). Lower-case only so the
+# order is the same under MySQL's case-insensitive collations, and keys never
+# end in "0" (a trailing zero would sort differently from the same fraction
+# without it).
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+RANK_WIDTH = 12  # 36**12 microseconds is far beyond any realistic clock value
+RANK_MAX_LENGTH = 64  # column size
+# Keys longer than this mean a region of the list has been split many times
+REBALANCE_LENGTH = int(RANK_MAX_LENGTH * 0.75)
+
+
+def _encode(value: int, width: int = RANK_WIDTH) -> str:
+    chars = []
+    for _ in range(width):
+        value, digit = divmod(value, BASE)
+        chars.append(DIGITS[digit])
+    return "".join(reversed(chars))
+
+def _time_value() -> int:
+    return int(datetime.now(timezone.utc).timestamp() * 1_000_000)
+
+def append_rank() -> str:
+    """Rank that sorts after every existing task, without reading any of them.
+
+    Appended ranks are the current time, so they grow monotonically and stay
+    above every key produced by moves or rebalances (those are kept below "now").
+    """
+    return _encode(_time_value()) + random.choice(DIGITS[1:])
+
+def rank_between(a: Optional[str], b: Optional[str]) -> str:
+    """Key strictly between a and b (None meaning the start/end of the list)."""
+    a = a or ""
+    if b is not None and b <= a:
+        raise ValueError(f"rank {a!r} must sort before {b!r}")
+    if b is None and a < append_rank()[:RANK_WIDTH]:
+        # Moving to the end: stay below ranks appended from now on
+        b = append_rank()
+    return _midpoint(a, b)
+
+def _midpoint(a: str, b: Optional[str]) -> str:
+    if b is not None:
+        # Shared prefix (padding a with zeros) is carried over unchanged
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else "0") == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+    da = DIGITS.index(a[0]) if a else 0
+    db = DIGITS.index(b[0]) if b else BASE
+    if db - da > 1:
+        return DIGITS[(da + db) // 2]
+    if b is not None and len(b) > 1:
+        # Adjacent first digits: b's first digit alone sorts between them
+        return b[0]
+    return DIGITS[da] + _midpoint(a[1:], None)
+
+def spaced_ranks(count: int) -> list[str]:
+    """`count` increasing, evenly spaced ranks below the current append rank."""
+    upper = _time_value()
+    step = upper // (count + 1)
+    return [_encode(step * (i + 1)) + "i" for i in range(count)]
+
+def needs_rebalance(rank: str) -> bool:
+    return len(rank) > REBALANCE_LENGTH
+
+
+async def apply_ranks(db, user_id, ordered_ids, chunk_size=1000, touch=True):
+    """Write evenly spaced ranks for task ids in list order, one UPDATE per chunk.
+
+    touch=False leaves updated_at alone, for migrations that run before that
+    column exists.
+    """
+    ranks = spaced_ranks(len(ordered_ids))
+    for start in range(0, len(ordered_ids), chunk_size):
+        ids = ordered_ids[start:start + chunk_size]
+        positions = range(start, start + len(ids))
+        values = {
+            "rank": case({task_id: ranks[i] for task_id, i in zip(ids, positions)}, value=Task.task_id),
+            "order": case({task_id: i for task_id, i in zip(ids, positions)}, value=Task.task_id),
+        }
+        if touch:
+            values["updated_at"] = datetime.utcnow()
+        await db.exec(
+            update(Task)
+            .where(Task.user_id == user_id, Task.task_id.in_(ids))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+
+async def rebalance_ranks(db, user_id):
+    """Respace every rank of a user's list, keeping the current order."""
+    result = await db.exec(
+        select(Task.task_id).where(Task.user_id == user_id).order_by(Task.rank, Task.task_id)
+    )
+    await apply_ranks(db, user_id, list(result.all()))
+    await bump_versions(db, user_id, "tasks")
+    await db.commit()
@@ -0,0 +1,259 @@
+from sqlmodel import select, update
+from sqlalchemy.orm.attributes import set_committed_value
+from datetime import date, datetime, timedelta
+from models import Task, Subtask
+from ranking import append_rank
+from versions import bump_versions
+from subtasks import load_subtasks, subtask_rows
+from search import index_documents, task_terms
+import calendar
+import os
+import uuid
+
+# Recurring tasks are stored as a series of ordinary Task rows (occurrences)
+# sharing a series_id, so due-date filters and the "due today" stats count
+# them through the existing (user_id, due_date) index. The latest occurrence
+# of a series is its head: only the head has next_due set, the date of the
+# first occurrence not yet materialized.
+
+RECURRENCE_HORIZON_DAYS = int(os.getenv("RECURRENCE_HORIZON_DAYS", "30"))  # furthest a due-date query materializes
+RECURRENCE_INTERVAL = int(os.getenv("RECURRENCE_INTERVAL", "3600"))
+RECURRENCE_BATCH_SIZE = int(os.getenv("RECURRENCE_BATCH_SIZE", "500"))
+MAX_OCCURRENCES_PER_RUN = 400  # per series, bounds a single materialization
+
+PRESETS = {"daily": "FREQ=DAILY", "weekly": "FREQ=WEEKLY", "monthly": "FREQ=MONTHLY"}
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+# Fields copied from the head to each new occurrence
+COPIED_FIELDS = ("user_id", "title", "description", "priority", "category", "recurring", "series_id", "series_start")
+
+
+class RecurrenceRule:
+    """A Task.recurring value.
+
+    Either a preset ("daily", "weekly", "monthly") or a custom rule in a small
+    RRULE subset: FREQ=DAILY|WEEKLY|MONTHLY, INTERVAL=n, BYDAY=MO,WE (weekly),
+    BYMONTHDAY=d (monthly, -1 for the last day) and UNTIL=YYYYMMDD, e.g.
+    "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH".
+    """
+
+    def __init__(self, freq, interval=1, byday=(), bymonthday=None, until=None):
+        self.freq = freq
+        self.interval = interval
+        self.byday = tuple(sorted(set(byday)))
+        self.bymonthday = bymonthday
+        self.until = until
+
+    @classmethod
+    def parse(cls, value: str):
+        text = PRESETS.get(value.strip().lower(), value.strip())
+        parts = {}
+        for part in text.split(";"):
+            key, sep, val = part.partition("=")
+            if not sep:
+                raise ValueError(f"Invalid recurrence rule part {part!r}")
+            parts[key.strip().upper()] = val.strip().upper()
+
+        freq = parts.pop("FREQ", None)
+        if freq not in ("DAILY", "WEEKLY", "MONTHLY"):
+            raise ValueError("FREQ must be DAILY, WEEKLY or MONTHLY")
+        try:
+            interval = int(parts.pop("INTERVAL", "1"))
+            byday = [WEEKDAYS.index(d) for d in parts.pop("BYDAY").split(",")] if "BYDAY" in parts else ()
+            bymonthday = int(parts.pop("BYMONTHDAY")) if "BYMONTHDAY" in parts else None
+            until = datetime.strptime(parts.pop("UNTIL"), "%Y%m%d").date() if "UNTIL" in parts else None
+        except ValueError:
+            raise ValueError(f"Invalid recurrence rule {value!r}")
+        if parts:
+            raise ValueError(f"Unsupported recurrence rule parts: {', '.join(parts)}")
+        if not 1 <= interval <= 366:
+            raise ValueError("INTERVAL must be between 1 and 366")
+        if byday and freq != "WEEKLY":
+            raise ValueError("BYDAY is only supported with FREQ=WEEKLY")
+        if bymonthday is not None and (freq != "MONTHLY" or bymonthday == 0 or not -1 <= bymonthday <= 31):
+            raise ValueError("BYMONTHDAY must be 1-31 or -1 with FREQ=MONTHLY")
+        return cls(freq, interval, byday, bymonthday, until)
+
+    def next_after(self, day: date, anchor: date = None):
+        """First occurrence strictly after day, or None once the series has ended.
+
+        anchor is the series' first date; monthly rules without BYMONTHDAY
+        keep its day of the month (clamped to shorter months).
+        """
+        if self.freq == "DAILY":
+            nxt = day + timedelta(days=self.interval)
+        elif self.freq == "WEEKLY":
+            if not self.byday:
+                nxt = day + timedelta(weeks=self.interval)
+            else:
+                later = [d for d in self.byday if d > day.weekday()]
+                if later:
+                    nxt = day + timedelta(days=later[0] - day.weekday())
+                else:
+                    week_start = day - timedelta(days=day.weekday()) + timedelta(weeks=self.interval)
+                    nxt = week_start + timedelta(days=self.byday[0])
+        else:
+            months = day.year * 12 + day.month - 1 + self.interval
+            year, month = divmod(months, 12)
+            month += 1
+            last = calendar.monthrange(year, month)[1]
+            target = self.bymonthday or (anchor or day).day
+            nxt = date(year, month, last if target == -1 else min(target, last))
+        if self.until is not None and nxt > self.until:
+            return None
+        return nxt
+
+    def first_on_or_after(self, day: date, floor: date, anchor: date = None):
+        """Occurrence at or after floor, stepping from the occurrence day."""
+        while day is not None and day < floor:
+            day = self.next_after(day, anchor)
+        return day
+
+
+def parse_rule(value):
+    """RecurrenceRule for a Task.recurring value, None if the task does not recur."""
+    if not value:
+        return None
+    return RecurrenceRule.parse(value)
+
+def _stored_rule(value):
+    # Rules are validated on write; anything unparseable (legacy data) just stops recurring
+    try:
+        return parse_rule(value)
+    except ValueError:
+        return None
+
+def _as_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+def today():
+    return datetime.utcnow().date()
+
+
+async def start_series(db, task: Task):
+    """Make task the head of its series after its rule or due date changed.
+
+    The next occurrence follows its due date (or today, for a task without
+    one). Editing an earlier occurrence ends the series' current head, so the
+    series continues from this task instead.
+    """
+    if task.series_id and task.next_due is None:
+        await db.exec(
+            update(Task)
+            .where(Task.series_id == task.series_id, Task.task_id != task.task_id, Task.next_due.is_not(None))
+            .values(next_due=None)
+        )
+    rule = _stored_rule(task.recurring)
+    if rule is None:
+        task.next_due = None
+        return
+    base = _as_date(task.due_date) or today()
+    task.series_id = task.task_id if task.next_due is None else task.series_id or task.task_id
+    task.series_start = base.isoformat()
+    nxt = rule.next_after(base, base)
+    task.next_due = nxt.isoformat() if nxt else None
+
+
+async def _claim(db, head, next_due):
+    # Conditional update: a concurrent materialization of the same head loses
+    result = await db.exec(
+        update(Task)
+        .where(Task.task_id == head.task_id, Task.next_due == head.next_due)
+        .values(next_due=next_due)
+    )
+    if result.rowcount != 1:
+        return False
+    # The loaded head (returned to the client by update_task) sees the claim, without an extra UPDATE
+    set_committed_value(head, "next_due", next_due)
+    return True
+
+async def materialize(db, heads, until=None):
+    """Create the occurrences of each head's series up to until (one each when None).
+
+    Occurrences follow the calendar, not completion: an open daily task still
+    gets a new row each day. Missed occurrences before today are skipped
+    rather than back-filled. Inserts new rows and their unchecked subtasks in
+    bulk; the caller commits. Returns the number of occurrences created.
+    """
+    current = today()
+    rows = []
+    copied_from = {}  # new task_id -> head task_id, for subtasks
+    users = set()
+    for head in heads:
+        rule = _stored_rule(head.recurring)
+        anchor = _as_date(head.series_start)
+        due = rule.first_on_or_after(_as_date(head.next_due), current, anchor) if rule else None
+        chain = []
+        limit = 1 if until is None else MAX_OCCURRENCES_PER_RUN
+        while due is not None and len(chain) < limit and (until is None or due <= until):
+            chain.append(due)
+            due = rule.next_after(due, anchor)
+        # The head keeps the (fast-forwarded) frontier only if nothing was created
+        if not await _claim(db, head, None if chain or due is None else due.isoformat()):
+            continue
+        now = datetime.utcnow()
+        for i, day in enumerate(chain):
+            nxt = due if i == len(chain) - 1 else None
+            row = {field: getattr(head, field) for field in COPIED_FIELDS}
+            row.update(
+                task_id=f"task_{uuid.uuid4().hex[:12]}",
+                rank=append_rank(),
+                due_date=day.isoformat(),
+                next_due=nxt.isoformat() if nxt else None,
+                completed=False,
+                order=0,
+                subtasks="[]",
+                created_at=now,
+                updated_at=now,
+            )
+            rows.append(row)
+            copied_from[row["task_id"]] = head.task_id
+            users.add(head.user_id)
+    if not rows:
+        return 0
+
+    await db.exec(Task.__table__.insert(), params=rows)
+    checklists = await load_subtasks(db, set(copied_from.values()))
+    subtask_params = []
+    docs = []
+    for row in rows:
+        items = [{**s, "completed": False} for s in checklists[copied_from[row["task_id"]]]]
+        subtask_params.extend(subtask_rows(row["user_id"], row["task_id"], items))
+        docs.append((row["user_id"], "task", row["task_id"],
+                     task_terms(row["title"], row["description"], [s["title"] for s in items])))
+    if subtask_params:
+        await db.exec(Subtask.__table__.insert(), params=subtask_params)
+    await index_documents(db, docs, new=True)
+    for user_id in users:
+        await bump_versions(db, user_id, "tasks")
+    return len(rows)
+
+async def materialize_for_user(db, user_id, until: date):
+    """Lazily create one user's occurrences due by until (capped at the horizon).
+
+    Returns whether any series head was touched, i.e. whether to commit.
+    """
+    until = min(until, today() + timedelta(days=RECURRENCE_HORIZON_DAYS))
+    heads = (await db.exec(
+        select(Task).where(Task.user_id == user_id, Task.next_due <= until.isoformat())
+    )).all()
+    if heads:
+        await materialize(db, heads, until)
+    return bool(heads)
+
+async def advance_recurring_tasks(db, batch_size=RECURRENCE_BATCH_SIZE):
+    """Scheduled job: materialize every user's occurrences due by today, in batches."""
+    until = today()
+    created = 0
+    while True:
+        heads = (await db.exec(
+            select(Task).where(Task.next_due <= until.isoformat()).order_by(Task.next_due).limit(batch_size)
+        )).all()
+        if not heads:
+            break
+        made = await materialize(db, heads, until)
+        await db.commit()
+        created += made
+    return created
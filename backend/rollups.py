@@ -0,0 +1,125 @@
+from sqlmodel import select, func, and_, delete
+from datetime import datetime, date
+from models import DailyRollup, Task, ActivityLog, ActivityLogSummary, PomodoroSession
+from upserts import upsert_increment
+from versions import bump_all_users
+import argparse
+import asyncio
+
+ROLLUP_COUNTERS = ("completed_count", "completion_events", "pomodoro_count")
+
+def rollup_day(value):
+    # Day a completed_at/created_at value falls on; tolerates ISO strings from imports
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return None
+
+def completion_day(task):
+    # Day a task contributes to completed_count, or None
+    if not task.completed:
+        return None
+    return rollup_day(task.completed_at)
+
+async def bump_rollup(db, user_id, day, **deltas):
+    """Add deltas to the (user_id, day) rollup row inside the caller's transaction."""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if day is None or not deltas:
+        return
+    unknown = set(deltas) - set(ROLLUP_COUNTERS)
+    if unknown:
+        raise ValueError(f"Unknown rollup counters: {sorted(unknown)}")
+    await upsert_increment(
+        db, DailyRollup, {"user_id": user_id, "day": day}, deltas,
+        defaults={k: 0 for k in ROLLUP_COUNTERS},
+    )
+
+def completion_changes(before_day, after_day):
+    # {day: deltas} moving a task's contribution from one day (or none) to another
+    if before_day == after_day:
+        return {}
+    return {day: {"completed_count": n} for day, n in ((before_day, -1), (after_day, 1)) if day is not None}
+
+async def bump_rollups(db, user_id, changes):
+    """bump_rollup for each {day: deltas} entry, one upsert per day."""
+    for day, deltas in changes.items():
+        await bump_rollup(db, user_id, day, **deltas)
+
+
+async def _grouped_counts(db, model, day_column, *conditions, user_id=None):
+    if user_id is not None:
+        conditions = conditions + (model.user_id == user_id,)
+    day_expr = func.date(day_column)
+    result = await db.exec(
+        select(model.user_id, day_expr, func.count())
+        .where(and_(*conditions))
+        .group_by(model.user_id, day_expr)
+    )
+    return [(uid, rollup_day(day), int(n)) for uid, day, n in result.all()]
+
+async def backfill_rollups(db, user_id=None, batch_size=1000):
+    """Rebuild DailyRollup from Task, ActivityLog (and its summaries) and PomodoroSession rows."""
+    rows = {}
+
+    def add(entries, counter):
+        for uid, day, n in entries:
+            if day is None:
+                continue
+            row = rows.setdefault((uid, day), {k: 0 for k in ROLLUP_COUNTERS})
+            row[counter] += n
+
+    add(await _grouped_counts(db, Task, Task.completed_at,
+                              Task.completed == True, Task.completed_at.is_not(None),
+                              user_id=user_id), "completed_count")
+    add(await _grouped_counts(db, ActivityLog, ActivityLog.created_at,
+                              ActivityLog.action == "completed",
+                              user_id=user_id), "completion_events")
+    # Entries past the retention window survive only as per-day summaries
+    summaries = select(ActivityLogSummary.user_id, ActivityLogSummary.day, ActivityLogSummary.count).where(
+        ActivityLogSummary.action == "completed")
+    if user_id is not None:
+        summaries = summaries.where(ActivityLogSummary.user_id == user_id)
+    add([(uid, rollup_day(day), n) for uid, day, n in (await db.exec(summaries)).all()], "completion_events")
+    # Pomodoro sessions carry no completion time; their start day is the closest we have
+    add(await _grouped_counts(db, PomodoroSession, PomodoroSession.created_at,
+                              PomodoroSession.completed == True,
+                              user_id=user_id), "pomodoro_count")
+
+    clear = delete(DailyRollup)
+    if user_id is not None:
+        clear = clear.where(DailyRollup.user_id == user_id)
+    await db.exec(clear)
+
+    items = [{"user_id": uid, "day": day, **counts} for (uid, day), counts in rows.items()]
+    for i in range(0, len(items), batch_size):
+        await db.exec(DailyRollup.__table__.insert(), params=items[i:i + batch_size])
+    # Cached /api/stats responses were computed from the old rows
+    await bump_all_users(db, "tasks", user_id)
+    await db.commit()
+    return len(items)
+
+
+async def _main():
+    from database import engine, init_db, async_session
+
+    parser = argparse.ArgumentParser(description="Rebuild the per-user daily rollup table")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--user", help="Only rebuild rows for this user_id")
+    args = parser.parse_args()
+
+    await init_db()
+    async with async_session() as db:
+        count = await backfill_rollups(db, user_id=args.user)
+    await engine.dispose()
+    print(f"Wrote {count} rollup rows")
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,169 @@
+from sqlmodel import select, update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from models import SchedulerLease
+from metrics import Counter, Histogram, REGISTRY
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+
+logger = logging.getLogger("checktick.scheduler")
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))  # +/- fraction of each wait
+# How often each worker checks whether a job is due; the lease decides who runs it
+SCHEDULER_POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS", "60"))
+
+JOB_RUNS = Counter("checktick_job_runs_total", "Scheduled job runs by outcome.", ("job", "status"))
+JOB_DURATION = Histogram(
+    "checktick_job_duration_seconds", "Scheduled job run time.", ("job",),
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900))
+REGISTRY.extend([JOB_RUNS, JOB_DURATION])
+
+
+class Job:
+    def __init__(self, name, interval, fn, max_runtime):
+        self.name = name
+        self.interval = interval
+        self.fn = fn  # async fn(db) -> rows affected
+        self.max_runtime = max_runtime
+        self.runs = 0
+        self.failures = 0
+        self.not_due = 0
+        self.last_run_at = None
+        self.last_duration = None
+        self.last_result = None
+        self.last_error = None
+
+
+class Scheduler:
+    """Periodic jobs run by at most one worker at a time.
+
+    Every worker polls every job; a SchedulerLease row decides who gets to
+    run it. The lease is held for max_runtime while the job runs and then
+    pushed to the next due time, so a job runs once per interval across all
+    workers rather than once per worker.
+    """
+
+    def __init__(self, jitter: float = SCHEDULER_JITTER):
+        self.jitter = jitter
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.jobs = {}
+        self._tasks = []
+
+    def add_job(self, name, interval, fn, max_runtime=None):
+        self.jobs[name] = Job(name, interval, fn, max_runtime or max(interval, 600))
+
+    def _jittered(self, seconds):
+        return seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _acquire(self, db, job):
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=job.max_runtime)
+        result = await db.exec(
+            update(SchedulerLease)
+            .where(SchedulerLease.job == job.name, SchedulerLease.lease_until < now)
+            .values(owner=self.owner, lease_until=lease_until, last_started_at=now, last_status="running")
+        )
+        if result.rowcount:
+            await db.commit()
+            return True
+        exists = (await db.exec(select(SchedulerLease.job).where(SchedulerLease.job == job.name))).first()
+        if exists:
+            return False
+        try:
+            db.add(SchedulerLease(job=job.name, owner=self.owner, lease_until=lease_until,
+                                  last_started_at=now, last_status="running"))
+            await db.commit()
+            return True
+        except IntegrityError:
+            # Another worker created the row first
+            await db.rollback()
+            return False
+
+    async def _release(self, db, job, started_at, status, result):
+        await db.exec(
+            update(SchedulerLease)
+            .where(SchedulerLease.job == job.name, SchedulerLease.owner == self.owner)
+            .values(lease_until=started_at + timedelta(seconds=job.interval), last_finished_at=datetime.utcnow(),
+                    last_status=status, last_result=result)
+        )
+        await db.commit()
+
+    async def run_job(self, session_factory, name):
+        """Run one job if it is due and no other worker holds it; returns whether it ran."""
+        job = self.jobs[name]
+        async with session_factory() as db:
+            if not await self._acquire(db, job):
+                job.not_due += 1
+                JOB_RUNS.inc(name, "not_due")
+                return False
+
+        started_at = datetime.utcnow()
+        start = time.perf_counter()
+        status, result = "ok", None
+        try:
+            async with session_factory() as db:
+                result = await job.fn(db)
+        except Exception as e:
+            status = "error"
+            job.failures += 1
+            job.last_error = repr(e)
+            logger.exception("Scheduled job %s failed", name)
+        finally:
+            job.runs += 1
+            job.last_run_at = started_at
+            job.last_duration = time.perf_counter() - start
+            job.last_result = result
+            JOB_RUNS.inc(name, status)
+            JOB_DURATION.observe(job.last_duration, name)
+            async with session_factory() as db:
+                await self._release(db, job, started_at, status, result)
+        return True
+
+    async def _loop(self, session_factory, job):
+        # Random start so workers booted together do not all race for the lease
+        await asyncio.sleep(random.uniform(0, min(job.interval, 60) * max(self.jitter, 0.05)))
+        while True:
+            try:
+                await self.run_job(session_factory, job.name)
+            except Exception:
+                logger.exception("Scheduler could not run %s", job.name)
+            await asyncio.sleep(self._jittered(min(job.interval, SCHEDULER_POLL_SECONDS)))
+
+    def start(self, session_factory):
+        if not SCHEDULER_ENABLED or self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._loop(session_factory, job)) for job in self.jobs.values()]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        return {
+            "enabled": SCHEDULER_ENABLED,
+            "owner": self.owner,
+            "jobs": {
+                job.name: {
+                    "interval_seconds": job.interval,
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "not_due": job.not_due,
+                    "last_run_at": job.last_run_at.isoformat() if job.last_run_at else None,
+                    "last_duration_seconds": round(job.last_duration, 3) if job.last_duration is not None else None,
+                    "last_result": job.last_result,
+                    "last_error": job.last_error,
+                }
+                for job in self.jobs.values()
+            },
+        }
+
+
+scheduler = Scheduler()
@@ -0,0 +1,187 @@
+from sqlmodel import select, delete, func, case, or_, and_
+from collections import Counter
+from models import Task, Subtask, StickyNote, SearchTerm
+import argparse
+import asyncio
+import re
+import unicodedata
+
+# A per-user inverted index kept in the SearchTerm table: one row per distinct
+# term of an item, weighted by the fields it occurs in. Handlers update it in
+# the same transaction as the item itself, so search results never run ahead
+# of or behind the data, on any worker.
+
+FIELD_WEIGHTS = {"title": 3.0, "subtask": 1.5, "description": 1.0, "content": 1.0}
+TERM_MAX_LENGTH = 64  # column size
+MAX_QUERY_TERMS = 8
+MIN_PREFIX_LENGTH = 2  # shorter query terms only match whole terms
+EXACT_MATCH_BONUS = 1.0
+SEARCH_LIMIT = 20
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    """Lower-case, accent-folded alphanumeric runs of text."""
+    if not text:
+        return []
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return [t[:TERM_MAX_LENGTH] for t in _TOKEN.findall(folded)]
+
+def document_terms(fields):
+    """{term: weight} for [(field, text), ...]; repeats add up with diminishing returns."""
+    weights = Counter()
+    for field, text in fields:
+        for term, n in Counter(tokenize(text)).items():
+            weights[term] += FIELD_WEIGHTS[field] * (1 + 0.2 * min(n - 1, 5))
+    return weights
+
+def task_terms(title, description, subtask_titles=()):
+    fields = [("title", title), ("description", description)]
+    fields.extend(("subtask", s) for s in subtask_titles)
+    return document_terms(fields)
+
+def note_terms(content):
+    return document_terms([("content", content)])
+
+
+async def index_documents(db, docs, new=False):
+    """Replace the index rows of each (user_id, kind, entity_id, terms) doc, in bulk.
+
+    new skips the delete for items that cannot have rows yet.
+    """
+    docs = list(docs)
+    if not docs:
+        return
+    for kind in set() if new else {doc[1] for doc in docs}:
+        ids = [entity_id for _, k, entity_id, _ in docs if k == kind]
+        await db.exec(delete(SearchTerm).where(SearchTerm.kind == kind, SearchTerm.entity_id.in_(ids)))
+    rows = [
+        {"user_id": user_id, "term": term, "kind": kind, "entity_id": entity_id, "weight": round(weight, 3)}
+        for user_id, kind, entity_id, terms in docs
+        for term, weight in terms.items()
+    ]
+    if rows:
+        await db.exec(SearchTerm.__table__.insert(), params=rows)
+
+async def unindex(db, kind, entity_ids):
+    if entity_ids:
+        await db.exec(delete(SearchTerm).where(SearchTerm.kind == kind, SearchTerm.entity_id.in_(list(entity_ids))))
+
+async def index_task(db, task, subtask_titles=(), new=False):
+    await index_documents(db, [(task.user_id, "task", task.task_id,
+                                task_terms(task.title, task.description, subtask_titles))], new)
+
+async def reindex_task(db, user_id, task_id):
+    """Re-read a task and its subtasks from the database and index them."""
+    task = (await db.exec(
+        select(Task.title, Task.description).where(Task.task_id == task_id, Task.user_id == user_id)
+    )).first()
+    if task is None:
+        return
+    titles = (await db.exec(select(Subtask.title).where(Subtask.task_id == task_id))).all()
+    await index_documents(db, [(user_id, "task", task_id, task_terms(task.title, task.description, titles))])
+
+async def index_note(db, note, new=False):
+    await index_documents(db, [(note.user_id, "note", note.note_id, note_terms(note.content))], new)
+
+
+def prefix_match(dialect_name, prefix):
+    # Terms are alphanumeric, so neither pattern needs escaping. SQLite only
+    # turns GLOB (not its case-insensitive LIKE) into an index range.
+    if dialect_name == "sqlite":
+        return SearchTerm.term.op("GLOB")(prefix + "*")
+    return SearchTerm.term.like(prefix + "%")
+
+def search_statement(dialect_name, user_id, query, kinds=("task", "note"), limit=SEARCH_LIMIT):
+    """Items matching every query term (as a prefix), best first; None for an empty query."""
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    conditions = [
+        prefix_match(dialect_name, term) if len(term) >= MIN_PREFIX_LENGTH else SearchTerm.term == term
+        for term in terms
+    ]
+    # An item must satisfy every term; one index row may satisfy several
+    # ("pro" and "project" both match "project"), so each term is checked on its own
+    matched = [func.max(case((cond, 1), else_=0)) == 1 for cond in conditions]
+    score = func.sum(SearchTerm.weight + case((SearchTerm.term.in_(terms), EXACT_MATCH_BONUS), else_=0.0))
+    return (
+        select(SearchTerm.kind, SearchTerm.entity_id, score.label("score"))
+        .where(SearchTerm.user_id == user_id, SearchTerm.kind.in_(kinds), or_(*conditions))
+        .group_by(SearchTerm.kind, SearchTerm.entity_id)
+        .having(and_(*matched))
+        .order_by(score.desc(), SearchTerm.entity_id)
+        .limit(limit)
+    )
+
+async def search(db, user_id, query, kinds=("task", "note"), limit=SEARCH_LIMIT):
+    """[(kind, entity_id, score)] for a query."""
+    stmt = search_statement(db.bind.dialect.name, user_id, query, kinds, limit)
+    if stmt is None:
+        return []
+    return [(kind, entity_id, round(score, 3)) for kind, entity_id, score in (await db.exec(stmt)).all()]
+
+
+async def rebuild_index(db, user_id=None, batch_size=1000):
+    """Rebuild SearchTerm from tasks, subtasks and notes (for one user or everyone); returns items indexed."""
+    stmt = delete(SearchTerm)
+    if user_id is not None:
+        stmt = stmt.where(SearchTerm.user_id == user_id)
+    await db.exec(stmt)
+
+    indexed = 0
+    task_stmt = select(Task.task_id, Task.user_id, Task.title, Task.description).order_by(Task.task_id)
+    note_stmt = select(StickyNote.note_id, StickyNote.user_id, StickyNote.content).order_by(StickyNote.note_id)
+    if user_id is not None:
+        task_stmt = task_stmt.where(Task.user_id == user_id)
+        note_stmt = note_stmt.where(StickyNote.user_id == user_id)
+
+    last = ""
+    while True:
+        tasks = (await db.exec(task_stmt.where(Task.task_id > last).limit(batch_size))).all()
+        if not tasks:
+            break
+        titles = {}
+        subtasks = await db.exec(
+            select(Subtask.task_id, Subtask.title).where(Subtask.task_id.in_([t.task_id for t in tasks]))
+        )
+        for task_id, title in subtasks.all():
+            titles.setdefault(task_id, []).append(title)
+        await index_documents(db, [
+            (t.user_id, "task", t.task_id, task_terms(t.title, t.description, titles.get(t.task_id, ())))
+            for t in tasks
+        ], new=True)
+        await db.commit()
+        indexed += len(tasks)
+        last = tasks[-1].task_id
+
+    last = ""
+    while True:
+        notes = (await db.exec(note_stmt.where(StickyNote.note_id > last).limit(batch_size))).all()
+        if not notes:
+            break
+        await index_documents(db, [(n.user_id, "note", n.note_id, note_terms(n.content)) for n in notes], new=True)
+        await db.commit()
+        indexed += len(notes)
+        last = notes[-1].note_id
+    return indexed
+
+
+async def _main():
+    from database import engine, init_db, async_session
+
+    parser = argparse.ArgumentParser(description="Rebuild the search index")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user", help="Only rebuild entries for this user_id")
+    args = parser.parse_args()
+
+    await init_db()
+    async with async_session() as db:
+        count = await rebuild_index(db, user_id=args.user)
+    await engine.dispose()
+    print(f"Indexed {count} items")
+
+if __name__ == "__main__":
+    asyncio.run(_main())
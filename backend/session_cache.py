@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+import os
+import time
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+# Kept short because invalidation is per process: with several workers a logout
+# on one worker is only seen by the others once their entry expires.
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "60"))
+
+
+class SessionCache:
+    """In-process LRU of session token -> user fields with per-entry expiry."""
+
+    def __init__(self, max_size: int = SESSION_CACHE_SIZE, ttl: float = SESSION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (deadline, user_id, user_data)
+        self._by_user = {}  # user_id -> set of tokens
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str):
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        deadline, _, user_data = entry
+        if deadline <= time.monotonic():
+            self._remove(token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user_data
+
+    def set(self, token: str, user_id: str, user_data: dict, expires_at: datetime):
+        if self.max_size <= 0:
+            return
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        # Never outlive the session itself
+        remaining = (expires_at - datetime.now(timezone.utc)).total_seconds()
+        lifetime = min(self.ttl, remaining)
+        if lifetime <= 0:
+            return
+        if token in self._entries:
+            self._remove(token)
+        self._entries[token] = (time.monotonic() + lifetime, user_id, user_data)
+        self._by_user.setdefault(user_id, set()).add(token)
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, token: str):
+        if token in self._entries:
+            self._remove(token)
+
+    def invalidate_user(self, user_id: str):
+        for token in list(self._by_user.get(user_id, ())):
+            self._remove(token)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_user.clear()
+
+    def _remove(self, token: str):
+        _, user_id, _ = self._entries.pop(token)
+        tokens = self._by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[user_id]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+session_cache = SessionCache()
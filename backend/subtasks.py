@@ -0,0 +1,64 @@
+from sqlmodel import select, delete
+from models import Subtask
+import json
+import uuid
+
+# Subtasks are read and written with Core statements rather than ORM
+# instances, so replacing a task's list twice in one session (e.g. /api/batch)
+# never trips over stale objects in the identity map.
+
+def subtask_rows(user_id, task_id, items):
+    """Rows for a client-supplied list of {id, title, completed}, in list order."""
+    rows = []
+    seen = set()
+    for position, item in enumerate(items or []):
+        if not isinstance(item, dict):
+            continue
+        subtask_id = str(item.get("id") or uuid.uuid4().hex[:12])
+        if subtask_id in seen:
+            continue
+        seen.add(subtask_id)
+        rows.append({
+            "task_id": task_id,
+            "subtask_id": subtask_id,
+            "user_id": user_id,
+            "title": str(item.get("title", "")),
+            "completed": bool(item.get("completed", False)),
+            "position": position,
+        })
+    return rows
+
+def parse_legacy_subtasks(value):
+    # Task.subtasks JSON as stored before the Subtask table
+    try:
+        items = json.loads(value) if value else []
+    except (TypeError, ValueError):
+        return []
+    return items if isinstance(items, list) else []
+
+async def insert_subtasks(db, user_id, task_id, items):
+    rows = subtask_rows(user_id, task_id, items)
+    if rows:
+        await db.exec(Subtask.__table__.insert(), params=rows)
+
+async def replace_subtasks(db, user_id, task_id, items):
+    await db.exec(delete(Subtask).where(Subtask.task_id == task_id, Subtask.user_id == user_id))
+    await insert_subtasks(db, user_id, task_id, items)
+
+def subtask_dict(row):
+    return {"id": row.subtask_id, "title": row.title, "completed": row.completed}
+
+async def load_subtasks(db, task_ids):
+    """{task_id: [subtask dicts]} for a page of tasks, in one query."""
+    task_ids = list(task_ids)
+    grouped = {task_id: [] for task_id in task_ids}
+    if not task_ids:
+        return grouped
+    result = await db.exec(
+        select(Subtask.task_id, Subtask.subtask_id, Subtask.title, Subtask.completed)
+        .where(Subtask.task_id.in_(task_ids))
+        .order_by(Subtask.task_id, Subtask.position, Subtask.subtask_id)
+    )
+    for row in result.all():
+        grouped[row.task_id].append(subtask_dict(row))
+    return grouped
@@ -0,0 +1,64 @@
+from sqlmodel import select, delete
+from datetime import datetime, timedelta
+from models import Task, StickyNote, NoteEdge, Tombstone
+from pagination import encode_cursor, decode_cursor
+import os
+
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+# Rows are matched on updated_at > since - overlap, so a write whose transaction
+# was still open when the previous sync ran is picked up next time. Clients
+# receive such rows twice and must apply changes idempotently.
+SYNC_OVERLAP = timedelta(seconds=int(os.getenv("SYNC_OVERLAP_SECONDS", "5")))
+
+SYNC_MODELS = {"tasks": Task, "notes": StickyNote, "edges": NoteEdge}
+
+def encode_sync_cursor(at: datetime):
+    return encode_cursor([at])
+
+def decode_sync_cursor(cursor: str):
+    return decode_cursor(cursor, [Tombstone.deleted_at])[0]
+
+def record_tombstones(db, user_id, collection, entity_ids):
+    # Same transaction as the delete itself
+    db.add_all([Tombstone(user_id=user_id, collection=collection, entity_id=i) for i in entity_ids])
+
+async def compact_tombstones(db, retention_days=TOMBSTONE_RETENTION_DAYS, batch_size=5000):
+    """Delete tombstones older than the retention window, in bounded batches."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    removed = 0
+    while True:
+        ids = (await db.exec(
+            select(Tombstone.id).where(Tombstone.deleted_at < cutoff).limit(batch_size)
+        )).all()
+        if not ids:
+            break
+        await db.exec(delete(Tombstone).where(Tombstone.id.in_(ids)))
+        await db.commit()
+        removed += len(ids)
+    return removed
+
+async def collect_changes(db, user_id, since, retention_days=TOMBSTONE_RETENTION_DAYS):
+    """Rows changed and ids deleted since `since` (None or too old means a full snapshot).
+
+    Returns (reset, {collection: rows}, {collection: deleted ids}). With reset
+    the rows are the complete live collections and the client must drop
+    anything it has that is not among them.
+    """
+    reset = since is None or since < datetime.utcnow() - timedelta(days=retention_days)
+    changed = {}
+    deleted = {name: [] for name in SYNC_MODELS}
+    for name, model in SYNC_MODELS.items():
+        stmt = select(model).where(model.user_id == user_id)
+        if not reset:
+            stmt = stmt.where(model.updated_at > since - SYNC_OVERLAP)
+        changed[name] = (await db.exec(stmt)).all()
+
+    if not reset:
+        result = await db.exec(
+            select(Tombstone.collection, Tombstone.entity_id).where(
+                Tombstone.user_id == user_id, Tombstone.deleted_at > since - SYNC_OVERLAP
+            )
+        )
+        for collection, entity_id in result.all():
+            deleted.setdefault(collection, []).append(entity_id)
+    return reset, changed, deleted
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, Table, Column, String, Integer, Boolean, DateTime, ForeignKey, select, func
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models  # noqa: E402  registers every table on SQLModel.metadata
+from migrations import MIGRATIONS, SchemaVersion, run_migrations  # noqa: E402
+
+# The schema as it was before the first migration, with no declared indexes
+baseline = MetaData()
+Table("user", baseline,
+      Column("user_id", String, primary_key=True), Column("email", String, unique=True), Column("name", String),
+      Column("password_hash", String), Column("picture", String), Column("created_at", DateTime))
+Table("task", baseline,
+      Column("task_id", String, primary_key=True), Column("user_id", String, ForeignKey("user.user_id")),
+      Column("title", String), Column("description", String), Column("priority", String), Column("category", String),
+      Column("due_date", String), Column("completed", Boolean), Column("order", Integer), Column("recurring", String),
+      Column("created_at", DateTime), Column("completed_at", DateTime), Column("subtasks", String))
+Table("activitylog", baseline,
+      Column("id", Integer, primary_key=True), Column("user_id", String), Column("action", String),
+      Column("task_id", String), Column("task_title", String), Column("created_at", DateTime))
+Table("pomodorosession", baseline,
+      Column("session_id", String, primary_key=True), Column("user_id", String), Column("task_id", String),
+      Column("duration", Integer), Column("completed", Boolean), Column("created_at", DateTime))
+Table("usersession", baseline,
+      Column("session_token", String, primary_key=True), Column("user_id", String),
+      Column("expires_at", DateTime), Column("created_at", DateTime))
+Table("stickynote", baseline,
+      Column("note_id", String, primary_key=True), Column("user_id", String, ForeignKey("user.user_id")),
+      Column("content", String), Column("color", String), Column("x_position", Integer), Column("y_position", Integer),
+      Column("z_index", Integer), Column("is_expanded", Boolean), Column("created_at", DateTime),
+      Column("updated_at", DateTime))
+Table("noteedge", baseline,
+      Column("edge_id", String, primary_key=True), Column("user_id", String, ForeignKey("user.user_id")),
+      Column("source", String, ForeignKey("stickynote.note_id")), Column("target", String, ForeignKey("stickynote.note_id")),
+      Column("created_at", DateTime))
+
+
+def seed(conn):
+    t = baseline.tables
+    now = datetime(2024, 1, 1)
+    conn.execute(t["user"].insert(), [{"user_id": "u1", "email": "a@x", "name": "A", "password_hash": "x", "created_at": now}])
+    conn.execute(t["task"].insert(), [
+        {"task_id": f"t{i}", "user_id": "u1", "title": f"Task {i}", "priority": "medium", "category": "personal",
+         "completed": i == 0, "order": 2 - i, "recurring": "daily" if i == 1 else None, "due_date": "2024-01-02",
+         "created_at": now, "completed_at": now if i == 0 else None,
+         "subtasks": '[{"id": "s1", "title": "Step", "completed": false}]'}
+        for i in range(3)
+    ])
+    conn.execute(t["activitylog"].insert(), [
+        {"user_id": "u1", "action": "completed", "task_id": "t0", "task_title": "Task 0", "created_at": now},
+    ])
+    conn.execute(t["stickynote"].insert(), [
+        {"note_id": n, "user_id": "u1", "content": n, "color": "yellow", "x_position": 0, "y_position": 0,
+         "z_index": 1, "is_expanded": True, "created_at": now, "updated_at": now}
+        for n in ("n1", "n2")
+    ])
+    # The baseline allowed duplicate edges
+    conn.execute(t["noteedge"].insert(), [
+        {"edge_id": "e1", "user_id": "u1", "source": "n1", "target": "n2", "created_at": now},
+        {"edge_id": "e2", "user_id": "u1", "source": "n1", "target": "n2", "created_at": now + timedelta(seconds=1)},
+    ])
+
+
+async def upgrade(path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(baseline.create_all)
+            await conn.run_sync(seed)
+        # What init_db does on startup
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        await run_migrations(engine)
+
+        async with engine.connect() as conn:
+            applied = (await conn.execute(select(SchemaVersion.version).order_by(SchemaVersion.version))).scalars().all()
+            edges = (await conn.execute(select(models.NoteEdge.edge_id))).scalars().all()
+            ranked = (await conn.execute(
+                select(models.Task.task_id).where(models.Task.rank != "").order_by(models.Task.rank)
+            )).scalars().all()
+            subtasks = (await conn.execute(select(func.count()).select_from(models.Subtask))).scalar()
+            terms = (await conn.execute(select(func.count()).select_from(models.SearchTerm))).scalar()
+        return applied, edges, ranked, subtasks, terms
+    finally:
+        await engine.dispose()
+
+
+def test_upgrade_baseline_database_to_head(tmp_path):
+    applied, edges, ranked, subtasks, terms = asyncio.run(upgrade(tmp_path / "baseline.db"))
+    assert applied == [version for version, _, _ in MIGRATIONS]
+    assert edges == ["e1"]  # the older duplicate is kept
+    assert ranked == ["t2", "t1", "t0"]  # seeded from the legacy order
+    assert subtasks == 3
+    assert terms > 0
@@ -0,0 +1,55 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/writes.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from database import init_db  # noqa: E402
+from query_counter import count_queries  # noqa: E402
+
+# Write handlers answer from what they just wrote: one commit, and no reads
+# after it (the counter's statements are recorded by metrics.instrument_engine)
+
+
+async def measure(client, method, url, **kwargs):
+    with count_queries() as counter:
+        response = await client.request(method, url, **kwargs)
+    assert response.status_code == 200, response.text
+    return response.json(), counter
+
+def assert_no_reload(counter):
+    assert counter.commits == 1, counter.statements
+    after_commit = counter.statements[counter.commit_offsets[-1]:]
+    assert not [s for s in after_commit if s.lstrip().upper().startswith("SELECT")], after_commit
+
+
+async def run():
+    await init_db()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.post("/api/auth/register", json={"name": "A", "email": "writes@example.com", "password": "pw"})
+        await client.post("/api/auth/login", json={"email": "writes@example.com", "password": "pw"})
+
+        task, counter = await measure(client, "POST", "/api/tasks", json={
+            "title": "Write once", "subtasks": [{"id": "s1", "title": "Step", "completed": False}],
+        })
+        assert_no_reload(counter)
+        assert task["subtasks"] == [{"id": "s1", "title": "Step", "completed": False}]
+
+        task, counter = await measure(client, "PUT", f"/api/tasks/{task['task_id']}", json={"title": "Renamed"})
+        assert_no_reload(counter)
+        assert task["title"] == "Renamed" and task["subtasks"][0]["id"] == "s1"
+
+        note = (await client.post("/api/notes", json={"content": "draft"})).json()
+        note, counter = await measure(client, "PUT", f"/api/notes/{note['note_id']}", json={"content": "final"})
+        assert_no_reload(counter)
+        assert note["content"] == "final"
+
+
+def test_write_handlers_do_not_read_after_commit():
+    asyncio.run(run())
@@ -0,0 +1,52 @@
+from sqlalchemy import update
+from sqlalchemy.dialects import mysql, sqlite, postgresql
+from sqlmodel import select
+
+_upsert_insert = {
+    "mysql": mysql.insert,
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+async def upsert_increment(db, model, key, deltas, defaults=None):
+    """Insert a counter row or add deltas to it, in one statement where the dialect allows.
+
+    key maps primary-key columns to values; deltas maps counter columns to
+    increments; defaults fills the remaining columns of a newly inserted row.
+    """
+    values = {**key, **(defaults or {}), **deltas}
+    dialect = db.bind.dialect.name
+    insert = _upsert_insert.get(dialect)
+    if insert is None:
+        # Generic fallback: read-modify-write
+        row = await db.get(model, tuple(key.values()))
+        if row is None:
+            db.add(model(**values))
+        else:
+            for column, delta in deltas.items():
+                setattr(row, column, getattr(row, column) + delta)
+        return
+
+    increments = {column: getattr(model, column) + delta for column, delta in deltas.items()}
+    stmt = insert(model).values(**values)
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(**increments)
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=list(key), set_=increments)
+    await db.exec(stmt)
+
+async def update_returning(db, model, where, values):
+    """UPDATE the row matching where and return it, or None if nothing matched.
+
+    One UPDATE ... RETURNING where the dialect supports it (SQLite, Postgres,
+    MariaDB); otherwise a SELECT followed by the unit-of-work UPDATE.
+    """
+    if db.bind.dialect.update_returning:
+        stmt = update(model).where(*where).values(**values).returning(model)
+        return (await db.execute(stmt)).scalars().first()
+
+    row = (await db.exec(select(model).where(*where))).first()
+    if row is not None:
+        for column, value in values.items():
+            setattr(row, column, value)
+    return row
@@ -0,0 +1,70 @@
+from fastapi import Request, Response
+from sqlmodel import select, update, insert, literal, exists
+from models import CollectionVersion, User
+from upserts import upsert_increment
+from events import stage_change
+import hashlib
+
+COLLECTIONS = ("tasks", "notes", "edges", "pomodoro")
+
+async def bump_versions(db, user_id, *collections):
+    """Mark collections as changed (and notify the user's event streams); call before the write's commit."""
+    stage_change(db, user_id, collections)
+    for collection in collections:
+        await upsert_increment(db, CollectionVersion, {"user_id": user_id, "collection": collection}, {"version": 1})
+
+async def bump_all_users(db, collection, user_id=None):
+    # For bulk jobs that rewrite data outside the request handlers. Users with no
+    # row yet get one; otherwise they would keep version 0 and any ETag built on it
+    if user_id is not None:
+        await upsert_increment(db, CollectionVersion, {"user_id": user_id, "collection": collection}, {"version": 1})
+        return
+    await db.exec(
+        update(CollectionVersion).where(CollectionVersion.collection == collection)
+        .values(version=CollectionVersion.version + 1)
+    )
+    has_row = select(CollectionVersion.user_id).where(
+        CollectionVersion.collection == collection, CollectionVersion.user_id == User.user_id
+    )
+    await db.exec(insert(CollectionVersion).from_select(
+        ["user_id", "collection", "version"],
+        select(User.user_id, literal(collection), literal(1)).where(~exists(has_row)),
+    ))
+
+async def get_versions(db, user_id, *collections):
+    result = await db.exec(
+        select(CollectionVersion.collection, CollectionVersion.version).where(
+            CollectionVersion.user_id == user_id, CollectionVersion.collection.in_(collections)
+        )
+    )
+    found = dict(result.all())
+    return [found.get(c, 0) for c in collections]
+
+def make_etag(request: Request, user_id, parts):
+    # The query string (page, filters, projection) changes the body, so it is part of the tag
+    query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    digest = hashlib.sha1(f"{user_id}|{request.url.path}|{query}".encode()).hexdigest()[:12]
+    return '"' + "-".join(str(p) for p in parts) + "-" + digest + '"'
+
+def etag_matches(request: Request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in candidates
+
+async def check_not_modified(request: Request, response: Response, db, user_id, *collections, extra=()):
+    """Return a 304 response if the client's copy is current, else set ETag on response.
+
+    Versions are read before any rows, so a write landing in between yields a
+    newer body under the older tag (revalidated next time), never the reverse.
+    """
+    versions = await get_versions(db, user_id, *collections)
+    etag = make_etag(request, user_id, [*versions, *extra])
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
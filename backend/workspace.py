@@ -0,0 +1,199 @@
+from fastapi import HTTPException
+from sqlmodel import select, tuple_
+from datetime import datetime
+from pydantic import ValidationError
+from models import Task, Subtask, StickyNote, NoteEdge, PomodoroSession, ActivityLog
+from note_buffer import note_buffer
+from versions import bump_versions, COLLECTIONS
+from rollups import backfill_rollups
+from search import rebuild_index
+import orjson
+import os
+
+# A workspace export is NDJSON: a "meta" line, then one {"type": ..., "data": {...}}
+# line per row, parents before children (tasks before their subtasks, notes
+# before edges). user_id is left out so the file can be imported into any
+# account; ActivityLog ids are local to a database and left out as well.
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_BATCH_SIZE = 1000  # rows per server-side cursor fetch and per yielded chunk
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_LINE_BYTES = 1_000_000
+
+# type -> model, in file order
+EXPORT_TYPES = {
+    "task": Task,
+    "subtask": Subtask,
+    "note": StickyNote,
+    "edge": NoteEdge,
+    "pomodoro": PomodoroSession,
+    "activity": ActivityLog,
+}
+_OMITTED_COLUMNS = {"user_id", "id", "subtasks"}  # subtasks: Task's legacy JSON copy
+
+
+def _columns(model):
+    return [c for c in model.__table__.c if c.name not in _OMITTED_COLUMNS]
+
+def _line(record):
+    return orjson.dumps(record) + b"\n"
+
+def export_statements(user_id):
+    """(type, statement) for each exported table, each served by a user_id index."""
+    return [
+        ("task", select(*_columns(Task)).where(Task.user_id == user_id).order_by(Task.rank, Task.task_id)),
+        ("subtask", select(*_columns(Subtask)).join(Task, Task.task_id == Subtask.task_id)
+         .where(Task.user_id == user_id).order_by(Subtask.task_id, Subtask.position)),
+        ("note", select(*_columns(StickyNote)).where(StickyNote.user_id == user_id)
+         .order_by(StickyNote.created_at, StickyNote.note_id)),
+        ("edge", select(*_columns(NoteEdge)).where(NoteEdge.user_id == user_id)
+         .order_by(NoteEdge.created_at, NoteEdge.edge_id)),
+        ("pomodoro", select(*_columns(PomodoroSession)).where(PomodoroSession.user_id == user_id)),
+        ("activity", select(*_columns(ActivityLog)).where(ActivityLog.user_id == user_id)),
+    ]
+
+async def export_workspace(session_factory, user_id):
+    """NDJSON chunks of every row a user owns.
+
+    Rows are read through server-side cursors EXPORT_BATCH_SIZE at a time,
+    in one transaction, so memory stays flat and the tables are read as of
+    one snapshot (on MySQL) however large the account is.
+    """
+    yield _line({"type": "meta", "version": EXPORT_FORMAT_VERSION, "exported_at": datetime.utcnow()})
+    async with session_factory() as db:
+        for kind, stmt in export_statements(user_id):
+            result = await db.stream(stmt)
+            async for rows in result.partitions(EXPORT_BATCH_SIZE):
+                if kind == "note":
+                    # Include layout changes still waiting in the note buffer
+                    rows = [note_buffer.overlay(dict(row._mapping)) for row in rows]
+                else:
+                    rows = [row._mapping for row in rows]
+                yield b"".join(_line({"type": kind, "data": dict(row)}) for row in rows)
+
+
+async def _lines(chunks):
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail="Import line too long")
+    yield buffer
+
+def _parse_row(kind, data, user_id, now, line_number):
+    model = EXPORT_TYPES[kind]
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail=f"Line {line_number}: data must be an object")
+    fields = {name: data[name] for name in (c.name for c in _columns(model)) if name in data}
+    try:
+        row = model.model_validate({**fields, "user_id": user_id})
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Line {line_number}: invalid {kind}: {e.errors()[0]['msg']}")
+    values = {c.name: getattr(row, c.name) for c in model.__table__.c if c.name != "id"}
+    if kind in ("task", "note", "edge"):
+        # Newer than every sync cursor, so /api/sync reports imported rows to other devices
+        values["updated_at"] = now
+    return values
+
+
+def _key(kind, row):
+    if kind == "subtask":
+        return (row["task_id"], row["subtask_id"])
+    if kind == "activity":
+        return (row["action"], row["task_id"], row["created_at"])
+    return row[EXPORT_TYPES[kind].__table__.primary_key.columns[0].name]
+
+async def _existing_keys(db, kind, user_id, keys):
+    if kind == "subtask":
+        stmt = select(Subtask.task_id, Subtask.subtask_id).where(tuple_(Subtask.task_id, Subtask.subtask_id).in_(keys))
+    elif kind == "activity":
+        columns = (ActivityLog.action, ActivityLog.task_id, ActivityLog.created_at)
+        stmt = select(*columns).where(ActivityLog.user_id == user_id, tuple_(*columns).in_(keys))
+    else:
+        column = EXPORT_TYPES[kind].__table__.primary_key.columns[0]
+        # Any owner: ids are global, and another user's row must never be overwritten
+        return set((await db.exec(select(column).where(column.in_(keys)))).all())
+    return {tuple(row) for row in (await db.exec(stmt)).all()}
+
+async def _owned(db, model, user_id, ids):
+    key = model.__table__.primary_key.columns[0]
+    result = await db.exec(select(key).where(model.user_id == user_id, key.in_(list(ids))))
+    return set(result.all())
+
+async def _insert_batch(db, kind, user_id, rows):
+    """Insert one batch of a type, skipping rows already present or pointing at rows the user does not own."""
+    batch = {}
+    for row in rows:
+        batch.setdefault(_key(kind, row), row)
+    existing = await _existing_keys(db, kind, user_id, list(batch))
+    rows = [row for key, row in batch.items() if key not in existing]
+    if kind == "subtask" and rows:
+        tasks = await _owned(db, Task, user_id, {row["task_id"] for row in rows})
+        rows = [row for row in rows if row["task_id"] in tasks]
+    elif kind == "edge" and rows:
+        notes = await _owned(db, StickyNote, user_id, {n for row in rows for n in (row["source"], row["target"])})
+        pairs = set((await db.exec(
+            select(NoteEdge.source, NoteEdge.target)
+            .where(tuple_(NoteEdge.source, NoteEdge.target).in_([(row["source"], row["target"]) for row in rows]))
+        )).all())
+        rows = [row for row in rows
+                if row["source"] in notes and row["target"] in notes and (row["source"], row["target"]) not in pairs]
+    elif kind == "activity" and rows:
+        # Tasks come first in the file, so imported tasks count as owned here
+        tasks = await _owned(db, Task, user_id, {row["task_id"] for row in rows})
+        rows = [row for row in rows if row["task_id"] in tasks]
+    if rows:
+        await db.exec(EXPORT_TYPES[kind].__table__.insert(), params=rows)
+        await db.commit()
+    return len(rows)
+
+async def import_workspace(db, user_id, chunks):
+    """Import an export (an async iterable of bytes) into user_id's account.
+
+    Rows are inserted IMPORT_BATCH_SIZE at a time, each batch committed on its
+    own. Rows whose id already exists are skipped, so an interrupted import
+    can simply be run again. Returns {type: {"imported": n, "skipped": n}}.
+    """
+    counts = {kind: {"imported": 0, "skipped": 0} for kind in EXPORT_TYPES}
+    now = datetime.utcnow()
+    kind, rows = None, []
+
+    async def flush():
+        if rows:
+            inserted = await _insert_batch(db, kind, user_id, rows)
+            counts[kind]["imported"] += inserted
+            counts[kind]["skipped"] += len(rows) - inserted
+            rows.clear()
+
+    line_number = 0
+    async for line in _lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            record = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            raise HTTPException(status_code=400, detail=f"Line {line_number}: invalid JSON")
+        record_type = record.get("type") if isinstance(record, dict) else None
+        if record_type == "meta":
+            if record.get("version") != EXPORT_FORMAT_VERSION:
+                raise HTTPException(status_code=400, detail=f"Unsupported export version {record.get('version')}")
+            continue
+        if record_type not in EXPORT_TYPES:
+            raise HTTPException(status_code=400, detail=f"Line {line_number}: unknown type {record_type!r}")
+        if record_type != kind or len(rows) >= IMPORT_BATCH_SIZE:
+            await flush()
+            kind = record_type
+        rows.append(_parse_row(kind, record.get("data"), user_id, now, line_number))
+    await flush()
+
+    if any(c["imported"] for c in counts.values()):
+        # Derived data is rebuilt from the imported rows
+        await rebuild_index(db, user_id)
+        await backfill_rollups(db, user_id)
+        await bump_versions(db, user_id, *COLLECTIONS)
+        await db.commit()
+    return counts
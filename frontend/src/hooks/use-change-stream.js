@@ -0,0 +1,37 @@
+import { useEffect, useRef } from "react";
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || "http://localhost:8000";
+const API = `${BACKEND_URL}/api`;
+
+// Calls onChange when any of the given collections changes on the server
+// (from this tab, another tab or another device). Bursts are coalesced;
+// EventSource reconnects and resumes from the last event id on its own.
+export function useChangeStream(collections, onChange, { enabled = true, delay = 300 } = {}) {
+  const onChangeRef = useRef(onChange);
+  onChangeRef.current = onChange;
+  const key = collections.join(",");
+
+  useEffect(() => {
+    if (!enabled || typeof EventSource === "undefined") return;
+    const wanted = key.split(",");
+    const source = new EventSource(`${API}/events`, { withCredentials: true });
+    let timer = null;
+
+    const schedule = () => {
+      clearTimeout(timer);
+      timer = setTimeout(() => onChangeRef.current(), delay);
+    };
+    const handleChange = (event) => {
+      const { collections: changed = [] } = JSON.parse(event.data);
+      if (changed.some((c) => wanted.includes(c))) schedule();
+    };
+
+    source.addEventListener("change", handleChange);
+    // Too much was missed to replay: reload everything
+    source.addEventListener("reset", schedule);
+    return () => {
+      clearTimeout(timer);
+      source.close();
+    };
+  }, [key, enabled, delay]);
+}
@@ -25,6 +25,7 @@ import {
 } from "lucide-react";
 import { BarChart, Bar, XAxis, YAxis, ResponsiveContainer, Tooltip } from "recharts";
 import { format } from "date-fns";
+import { useChangeStream } from "../hooks/use-change-stream";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || "http://localhost:8000";
 const API = `${BACKEND_URL}/api`;
@@ -48,6 +49,8 @@ const Dashboard = () => {
     }
   }, [user]);
 
+  useChangeStream(["tasks", "pomodoro"], () => fetchData(), { enabled: !!user });
+
   const fetchData = async () => {
     try {
       const [statsRes, tasksRes] = await Promise.all([
@@ -19,6 +19,7 @@ import { useTheme } from "../context/ThemeContext";
 import { Button } from "../components/ui/button";
 import StickyNoteNode from '../components/StickyNoteNode';
 import { toast } from "sonner";
+import { useChangeStream } from "../hooks/use-change-stream";
 import {
     StickyNote as StickyNoteIcon,
     Plus,
@@ -71,6 +72,27 @@ const StickyNotesPage = () => {
         fetchData();
     }, []);
 
+    // Changes from other tabs/devices: reload only while the board is not in
+    // use, so a note being edited here is never overwritten
+    const staleRef = useRef(false);
+    useChangeStream(["notes", "edges"], () => {
+        if (document.hasFocus()) {
+            staleRef.current = true;
+        } else {
+            fetchData();
+        }
+    });
+    useEffect(() => {
+        const onFocus = () => {
+            if (staleRef.current) {
+                staleRef.current = false;
+                fetchData();
+            }
+        };
+        window.addEventListener("focus", onFocus);
+        return () => window.removeEventListener("focus", onFocus);
+    }, []);
+
     const fetchData = async () => {
         try {
             const [notesRes, edgesRes] = await Promise.all([
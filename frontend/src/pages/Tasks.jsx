@@ -51,12 +51,13 @@ import {
 } from "lucide-react";
 import { format } from "date-fns";
 import PomodoroModal from "../components/PomodoroModal";
+import { useChangeStream } from "../hooks/use-change-stream";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || "http://localhost:8000";
 const API = `${BACKEND_URL}/api`;
 
 // Sortable Task Item
-const SortableTaskItem = ({ task, onToggle, onEdit, onDelete, onStartPomodoro }) => {
+const SortableTaskItem = ({ task, onToggle, onToggleSubtask, onEdit, onDelete, onStartPomodoro }) => {
   const {
     attributes,
     listeners,
@@ -180,7 +181,7 @@ const SortableTaskItem = ({ task, onToggle, onEdit, onDelete, onStartPomodoro })
                   <div key={subtask.id} className="flex items-center gap-2">
                     <Checkbox
                       checked={subtask.completed}
-                      disabled
+                      onCheckedChange={() => onToggleSubtask(task, subtask)}
                       className="w-3 h-3"
                     />
                     <span className={`text-sm ${subtask.completed ? 'task-completed' : ''}`}>
@@ -475,6 +476,8 @@ const Tasks = () => {
     }
   }, [user]);
 
+  useChangeStream(["tasks"], () => fetchTasks(), { enabled: !!user });
+
   const fetchTasks = async () => {
     try {
       const response = await axios.get(`${API}/tasks`, { withCredentials: true });
@@ -539,12 +542,31 @@ const Tasks = () => {
         { withCredentials: true }
       );
       setTasks(tasks.map(t => t.task_id === task.task_id ? response.data : t));
+      if (!task.completed && task.recurring) {
+        // Completing a recurring task creates its next occurrence
+        fetchTasks();
+      }
       toast.success(task.completed ? "Task uncompleted" : "Task completed!");
     } catch (error) {
       toast.error("Failed to update task");
     }
   };
 
+  const handleToggleSubtask = async (task, subtask) => {
+    try {
+      const response = await axios.put(
+        `${API}/tasks/${task.task_id}/subtasks/${subtask.id}`,
+        { completed: !subtask.completed },
+        { withCredentials: true }
+      );
+      setTasks(tasks.map(t => t.task_id === task.task_id
+        ? { ...t, subtasks: t.subtasks.map(s => s.id === subtask.id ? response.data : s) }
+        : t));
+    } catch (error) {
+      toast.error("Failed to update subtask");
+    }
+  };
+
   const handleDeleteTask = async (taskId) => {
     try {
       await axios.delete(`${API}/tasks/${taskId}`, { withCredentials: true });
@@ -566,8 +588,15 @@ const Tasks = () => {
       setTasks(newTasks);
 
       try {
-        const taskOrders = newTasks.map((t, i) => ({ task_id: t.task_id, order: i }));
-        await axios.put(`${API}/tasks/reorder`, taskOrders, { withCredentials: true });
+        // Only the dragged task is rewritten: send its new neighbours
+        await axios.put(
+          `${API}/tasks/${active.id}/move`,
+          {
+            after_task_id: newTasks[newIndex - 1]?.task_id ?? null,
+            before_task_id: newTasks[newIndex + 1]?.task_id ?? null
+          },
+          { withCredentials: true }
+        );
       } catch (error) {
         console.error("Failed to save order:", error);
       }
@@ -772,6 +801,7 @@ const Tasks = () => {
                     key={task.task_id}
                     task={task}
                     onToggle={handleToggleTask}
+                    onToggleSubtask={handleToggleSubtask}
                     onEdit={(t) => { setEditingTask(t); setIsModalOpen(true); }}
                     onDelete={handleDeleteTask}
                     onStartPomodoro={setPomodoroTask}